@@ -0,0 +1,1077 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the crawler hot paths.
+
+Each benchmark checks that the new code gives the same answers as the old
+code on a synthetic corpus, then times both. The run exits with status 1
+if any check fails.
+
+Usage:
+    python bench_crawler.py                   # run everything
+    python bench_crawler.py url_classifier    # run one benchmark
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import da_crawler
+
+
+def best_of(fn, repeat=3):
+    """Run fn() `repeat` times and return (best seconds, last result)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def quiet(fn, *args, **kwargs):
+    """Call fn with its progress prints swallowed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+# Labels of the checks that failed in this run
+FAILURES = []
+
+
+def check(label, ok, detail="MISMATCH"):
+    """Print a correctness check; a failed one makes the run exit non-zero."""
+    if not ok:
+        FAILURES.append(label)
+    print(f"   {label}: {'OK' if ok else detail}")
+
+
+def report(name, before, after, units, unit_name):
+    print(f"   {name:<10} before: {units / before:>12,.0f} {unit_name}/s  ({before * 1000:.1f} ms)")
+    print(f"   {'':<10} after:  {units / after:>12,.0f} {unit_name}/s  ({after * 1000:.1f} ms)")
+    print(f"   {'':<10} speedup: {before / after:.1f}x")
+
+
+# ------------------------------
+# URL CLASSIFIER
+# ------------------------------
+
+def legacy_classify(link):
+    """The per-link pattern checks discover_all_links used to run inline."""
+    hard_exclude_patterns = [
+        r"\?share=",
+        r"[&#]share=",
+        r"/\d+-\d+x\d+/",
+        r"\d+x\d+\.(jpg|jpeg|png|gif|webp)",
+        r"#respond",
+        r"#comment",
+        r"/page/\d+",
+        r"/author/",
+        r"/writers?/",
+    ]
+    if any(re.search(pattern, link, re.I) for pattern in hard_exclude_patterns):
+        return "exclude"
+
+    soft_exclude_patterns = [
+        r"/category/?$", r"/categories/?$", r"/tag/?$", r"/tags/?$",
+        r"/topics?/?$", r"/archive/?$", r"/archives/?$", r"/\d{4}/?$",
+        r"/\d{4}/\d{2}/?$", r"/hub/?$", r"/all-articles/?$", r"/news/?$",
+        r"/world-news/?$", r"/politics/?$", r"/opinion/?$", r"/sports/?$",
+        r"/tech/?$", r"/business/?$", r"/story/?$",
+    ]
+    if any(re.search(pattern, link, re.I) for pattern in soft_exclude_patterns):
+        return "section"
+
+    if "/article/" in link:
+        return "article"
+    elif re.search(r"/(news|story)/20\d{2}/\d{2}/\d{2}/[\w-]+", link):
+        return "article"
+    elif re.search(r"/20\d{2}/\d{2}/\d{2}/[\w-]+", link):
+        return "article"
+    elif re.search(r"/20\d{2}/\d{2}/[\w-]{10,}", link) and not link.endswith('/'):
+        return "article"
+    elif re.search(r"/[\w-]{20,}/?$", link):
+        slug = link.rstrip('/').split('/')[-1]
+        category_words = [
+            'news', 'politics', 'world', 'business', 'sports',
+            'tech', 'technology', 'science', 'opinion', 'entertainment',
+            'lifestyle', 'health', 'culture', 'economy', 'society'
+        ]
+        if slug.lower() not in category_words:
+            return "article"
+    return "other"
+
+
+def make_links(n, seed=1):
+    rnd = random.Random(seed)
+    shapes = [
+        "/{y}/{m}/{d}/{slug}/",
+        "/{y}/{m}/{slug}",
+        "/{y}/{m}/{slug}/",
+        "/news/{y}/{m}/{d}/{slug}",
+        "/article/{slug}",
+        "/category/{word}/",
+        "/tag/{word}",
+        "/{word}/",
+        "/{y}/",
+        "/{y}/{m}/",
+        "/page/{d}",
+        "/author/{word}/",
+        "/{slug}",
+        "/{slug}/?share=twitter",
+        "/{slug}/#comment-{d}",
+        "/wp-content/uploads/{y}/{m}/img-300x200.jpg",
+        "/{word}",
+    ]
+    words = ["news", "politics", "world", "tech", "sports", "opinion", "business",
+             "health", "hub", "archive", "about", "markets", "economy"]
+    links = []
+    for _ in range(n):
+        slug = "-".join(rnd.choice(words) for _ in range(rnd.randint(1, 6)))
+        path = rnd.choice(shapes).format(
+            y=rnd.randint(2015, 2025),
+            m=f"{rnd.randint(1, 12):02d}",
+            d=f"{rnd.randint(1, 28):02d}",
+            slug=slug,
+            word=rnd.choice(words),
+        )
+        links.append("https://example.com" + path)
+    return links
+
+
+def bench_url_classifier(n=20000):
+    print(f"[url_classifier] {n:,} synthetic links")
+    links = make_links(n)
+    classifier = da_crawler.URLClassifier()
+
+    mismatches = [u for u in links if legacy_classify(u) != classifier.classify(u)[0]]
+    check("parity", not mismatches, f"{len(mismatches)} mismatches, e.g. {mismatches[:3]}")
+
+    before, _ = best_of(lambda: [legacy_classify(u) for u in links])
+    after, _ = best_of(lambda: [classifier.classify(u) for u in links])
+    report("links", before, after, n, "links")
+
+
+# ------------------------------
+# URL CANONICALIZATION
+# ------------------------------
+
+# (site, per-site rules, discovered URL, expected key)
+CANONICAL_CASES = [
+    ("http://blog.example.com/", None, "https://blog.example.com/a?utm_source=x", "https://blog.example.com/a"),
+    ("http://blog.example.com/", None, "http://BLOG.example.com:80/a#top", "https://blog.example.com/a"),
+    ("https://blog.example.com/", None, "http://blog.example.com/a", "https://blog.example.com/a"),
+    ("http://blog.example.com/", {"scheme": None}, "http://blog.example.com/a", "http://blog.example.com/a"),
+]
+
+
+def bench_canonical_urls(n=20000):
+    print(f"[canonical_urls] {len(CANONICAL_CASES)} cases, {n:,} links in http and https variants")
+    for site, rules, url, expected in CANONICAL_CASES:
+        key = da_crawler.URLCanonicalizer.for_site(site, rules)(url)
+        check(f"{url} on {site}", key == expected, key)
+
+    # An http site linking to its pages under both schemes: one key per page
+    links = make_links(n)
+    mixed = [link.replace("https://", "http://", 1) if i % 2 else link for i, link in enumerate(links)]
+    pages = {da_crawler.URLCanonicalizer.for_site("https://example.com/")(link) for link in links}
+    old = {da_crawler.URLCanonicalizer(scheme=None)(link) for link in mixed}
+    new = {da_crawler.URLCanonicalizer.for_site("http://example.com/")(link) for link in mixed}
+    check("one key per page", new == pages, f"{len(new):,} keys for {len(pages):,} pages")
+    print(f"   distinct keys (= fetches): {len(old):,} -> {len(new):,}")
+
+
+# ------------------------------
+# ARTICLE PAGES
+# ------------------------------
+
+WORDS = ("the market rallied after officials said inflation data would be released "
+         "later this week while analysts expect rates to stay on hold through summer").split()
+
+
+def sentence(rnd, lo=8, hi=30):
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(lo, hi))).capitalize() + "."
+
+
+def make_article_html(paragraphs=30, seed=1):
+    """A news-site article page: head, nav, sidebar, comments and footer around the story."""
+    rnd = random.Random(seed)
+    nav = "".join(f'<li><a href="/{w}/">{w.title()}</a></li>' for w in WORDS[:12])
+    body = []
+    for i in range(paragraphs):
+        if i % 8 == 4:
+            body.append(f"<h2>{sentence(rnd, 3, 8)}</h2>")
+        if i % 10 == 7:
+            body.append("<ul>" + "".join(f"<li>{sentence(rnd, 4, 12)}</li>" for _ in range(3)) + "</ul>")
+        if i % 12 == 9:
+            body.append(f'<div class="ad-slot"><script>loadAd({i})</script>Advertisement</div>')
+        body.append(f"<p>{sentence(rnd)} <a href=\"/2024/05/{i:02d}/related-story-{i}\">{sentence(rnd, 2, 5)}</a> {sentence(rnd)}</p>")
+    related = "".join(
+        f'<li><a href="/2024/04/{i:02d}/another-long-story-slug-{i}">{sentence(rnd, 4, 9)}</a></li>' for i in range(20)
+    )
+    comments = "".join(f'<div class="comment"><p>{sentence(rnd)}</p></div>' for _ in range(10))
+    return f"""<!DOCTYPE html>
+<html><head>
+<title>{sentence(rnd, 4, 9)}</title>
+<meta property="og:title" content="{sentence(rnd, 4, 9)}">
+<meta name="author" content="Jane Reporter">
+<meta property="article:published_time" content="2024-05-0{seed % 9 + 1}T08:30:00">
+<link rel="stylesheet" href="/style.css">
+<style>body {{ font-family: serif; }} .ad-slot {{ height: 250px; }}</style>
+<script type="application/ld+json">{{"@type": "NewsArticle", "headline": "x"}}</script>
+<script>window.dataLayer = window.dataLayer || []; {"var x = 1; " * 200}</script>
+</head><body>
+<header class="site-header"><nav><ul>{nav}</ul></nav></header>
+<div class="cookie-banner"><p>We use cookies to improve your experience on this site.</p></div>
+<main><article>
+<h1>{sentence(rnd, 4, 9)}</h1>
+<div class="entry-content">{"".join(body)}</div>
+<div class="share-buttons"><a href="/share?u=1">Share this story with friends</a></div>
+</article>
+<aside class="sidebar"><h3>Related stories on this topic</h3><ul>{related}</ul></aside>
+<section class="comments">{comments}</section>
+</main>
+<!-- analytics -->
+<footer class="site-footer"><p>Copyright 2024 Example News. All rights reserved.</p></footer>
+</body></html>"""
+
+
+def bench_parsed_page(n=200):
+    print(f"[parsed_page] {n} synthetic article pages")
+    pages = [make_article_html(paragraphs=30, seed=i) for i in range(n)]
+    # Inline code and noscript fallbacks inside paragraphs - none of it is page text
+    inline = (
+        '<script>var adslot = googletag.defineSlot("/1/story", [300, 250]);</script>'
+        "<style>.story { color: red }</style> and the sentence goes on"
+        '<noscript><img src="/pixel.gif"></noscript>.</p>'
+    )
+    pages[::4] = [html.replace("</p>", inline, 6) for html in pages[::4]]
+
+    def per_step(html):
+        # How crawl_site used to run: every step parses the raw HTML again
+        text = da_crawler.strip_html_basic(html)
+        meta = da_crawler.extract_metadata(html)
+        cleaned = da_crawler.manual_clean(html)
+        article_html = da_crawler.extract_article_content(html)
+        return text, meta[:2], cleaned, article_html
+
+    def shared(html):
+        page = da_crawler.ParsedPage(html, "https://example.com/2024/05/01/story")
+        text = page.text
+        meta = page.metadata()
+        cleaned = da_crawler.manual_clean(page)
+        return text, meta[:2], cleaned, page.article_html
+
+    mismatches = [i for i, html in enumerate(pages) if quiet(per_step, html) != quiet(shared, html)]
+    check("parity", not mismatches, f"{len(mismatches)} mismatches, e.g. pages {mismatches[:3]}")
+
+    before, _ = best_of(lambda: quiet(lambda: [per_step(html) for html in pages]))
+    after, _ = best_of(lambda: quiet(lambda: [shared(html) for html in pages]))
+    report("pages", before, after, n, "pages")
+
+
+def make_page_of_size(megabytes, seed=1):
+    """An article page padded with paragraphs to roughly the given size."""
+    paragraphs = 100
+    for _ in range(3):
+        html = make_article_html(paragraphs, seed)
+        paragraphs = max(1, int(paragraphs * megabytes * 1_000_000 / len(html)))
+    return make_article_html(paragraphs, seed)
+
+
+# ------------------------------
+# JUNK REMOVAL
+# ------------------------------
+
+def outermost_nodes(nodes):
+    """The nodes not inside another of them - removing these removes them all."""
+    ids = {node.mem_id for node in nodes}
+    roots = []
+    for node in nodes:
+        parent = node.parent
+        while parent is not None and parent.mem_id not in ids:
+            parent = parent.parent
+        if parent is None:
+            roots.append(node)
+    return roots
+
+
+def group_remove_junk(tree):
+    """Alternative: all of JUNK_SELECTORS as one group selector query."""
+    for node in outermost_nodes(tree.css(", ".join(da_crawler.JUNK_SELECTORS))):
+        node.decompose()
+
+
+def compile_junk_selectors(selectors):
+    """
+    Split selectors into what a single walk can test per node - tag names,
+    .class, #id and [class*=...]/[id*=...] - and the rest, which still need
+    one tree.css() query each.
+    """
+    tags, classes, ids, rest = set(), set(), set(), []
+    contains = {"class": [], "id": []}
+    for selector in selectors:
+        attribute = re.fullmatch(r"\[(class|id)\*=['\"]([^'\"]*)['\"]\]", selector)
+        if re.fullmatch(r"[a-z][a-z0-9]*", selector):
+            tags.add(selector)
+        elif re.fullmatch(r"\.[\w-]+", selector):
+            classes.add(selector[1:])
+        elif re.fullmatch(r"#[\w-]+", selector):
+            ids.add(selector[1:])
+        elif attribute:
+            contains[attribute.group(1)].append(attribute.group(2))
+        else:
+            rest.append(selector)
+    return tags, classes, ids, contains, rest
+
+
+def traversal_remove_junk(tree, compiled):
+    """Alternative: one traverse() over the whole tree, each node tested in Python."""
+    tags, classes, ids, contains, rest = compiled
+
+    def is_junk(node):
+        if node.tag in tags:
+            return True
+        attributes = node.attributes
+        name = attributes.get("class") or ""
+        if name and (not classes.isdisjoint(name.split()) or any(part in name for part in contains["class"])):
+            return True
+        ident = attributes.get("id") or ""
+        return bool(ident) and (ident in ids or any(part in ident for part in contains["id"]))
+
+    for node in outermost_nodes([node for node in tree.root.traverse() if is_junk(node)]):
+        node.decompose()
+    for selector in rest:
+        for node in tree.css(selector):
+            node.decompose()
+
+
+def bench_junk_removal(sizes=(1, 3, 5)):
+    print(f"[junk_removal] {len(da_crawler.JUNK_SELECTORS)} selectors on {', '.join(f'{mb} MB' for mb in sizes)} pages")
+    compiled = compile_junk_selectors(da_crawler.JUNK_SELECTORS)
+    alternatives = [
+        ("group selector", group_remove_junk),
+        ("single traversal", lambda tree: traversal_remove_junk(tree, compiled)),
+    ]
+
+    for mb in sizes:
+        html = make_page_of_size(mb)
+        reference = da_crawler.HTMLParser(html)
+        da_crawler.remove_junk(reference)
+        for name, remove in alternatives:
+            tree = da_crawler.HTMLParser(html)
+            remove(tree)
+            check(f"{mb} MB {name} parity", tree.html == reference.html)
+
+        # Only junk removal is timed - each run gets a freshly parsed tree
+        repeat = 5
+        timings = []
+        for name, remove in [("per-selector", da_crawler.remove_junk)] + alternatives:
+            trees = [da_crawler.HTMLParser(html) for _ in range(repeat)]
+            seconds, _ = best_of(lambda: remove(trees.pop()), repeat)
+            timings.append((name, seconds))
+        base = timings[0][1]
+        print(f"   {mb} MB  " + ", ".join(f"{name} {s * 1000:.1f} ms ({base / s:.1f}x)" for name, s in timings))
+
+
+# ------------------------------
+# EXTRACTION TEMPLATES
+# ------------------------------
+
+def bench_article_templates(n=200):
+    print(f"[article_templates] {n} synthetic pages from one site")
+    # Container deep in ARTICLE_SELECTORS, as on many real sites
+    pages = [
+        make_article_html(paragraphs=30, seed=i)
+        .replace("<main><article>", '<div id="page"><div class="post-body">')
+        .replace("</article>", "</div>")
+        .replace("</main>", "</div>")
+        for i in range(n)
+    ]
+
+    def search(html):
+        tree = da_crawler.HTMLParser(html)
+        return da_crawler._find_article_node(tree).html
+
+    def templated(html):
+        tree = da_crawler.HTMLParser(html)
+        return da_crawler._find_article_node(tree, "example.com").html
+
+    mismatches = [i for i, html in enumerate(pages) if quiet(search, html) != quiet(templated, html)]
+    check("parity", not mismatches, f"{len(mismatches)} mismatches, e.g. pages {mismatches[:3]}")
+    template = da_crawler.TEMPLATES.get("example.com")
+    print(f"   template: {template['selector']}")
+
+    # Learned on pages without junk in the story, then pages that carry some:
+    # the junk must still go
+    da_crawler.TEMPLATES = da_crawler.TemplateCache()
+    junk = '<script>track()</script><iframe src="/ad"></iframe><div class="newsletter">Sign up now</div>'
+    later = [re.sub(r'(class="entry-content">.*?</p>)', r"\1" + junk, html, count=1, flags=re.S) for html in pages[:20]]
+    quiet(lambda: [templated(html) for html in pages[20:40]])
+    mismatches = [i for i, html in enumerate(later) if quiet(search, html) != quiet(templated, html)]
+    check("parity on pages with new junk", not mismatches, f"{len(mismatches)} mismatches")
+
+    # A redesign wraps the old container in a better one: the old selector
+    # still matches every page, so only the periodic full search notices
+    da_crawler.TEMPLATES = da_crawler.TemplateCache()
+    lede = '<div class="post-content"><p>The lede now sits outside the entry content, in the new wrapper.</p>'
+    redesigned = [html.replace('<div class="post-body">', lede + '<div class="post-body">') for html in pages[40:100]]
+    quiet(lambda: [templated(html) for html in pages[:40] + redesigned[:40]])
+    mismatches = [i for i, html in enumerate(redesigned[40:]) if quiet(search, html) != quiet(templated, html)]
+    check("redesign learned again", not mismatches, f"{len(mismatches)} mismatches")
+
+    before, _ = best_of(lambda: quiet(lambda: [search(html) for html in pages]))
+    after, _ = best_of(lambda: quiet(lambda: [templated(html) for html in pages]))
+    report("pages", before, after, n, "pages")
+
+
+# ------------------------------
+# DENSITY EXTRACTION
+# ------------------------------
+
+def selector_extract(html):
+    """Junk removal, container selectors, <body> if none match - the pre-density behaviour."""
+    tree = da_crawler.HTMLParser(html)
+    _, article = da_crawler._search_article_node(tree)
+    return da_crawler._article_text(article or tree.body)
+
+
+def density_extract(html):
+    tree = da_crawler.HTMLParser(html)
+    da_crawler.remove_junk(tree)
+    return da_crawler._article_text(da_crawler._density_article_node(tree) or tree.body)
+
+
+def bench_density_extraction(n=100):
+    print(f"[density_extraction] {n} pages with a known container, {n} without")
+    with_container = [make_article_html(paragraphs=30, seed=i) for i in range(n)]
+    # No <article>/<main>/entry-content, and sidebar/comments under class
+    # names JUNK_SELECTORS doesn't know: the selector cascade finds nothing
+    without = [
+        html.replace("<main><article>", '<div id="wrap">')
+        .replace("</article>", "")
+        .replace("</main>", "</div>")
+        .replace('class="entry-content"', 'class="txt"')
+        .replace('class="sidebar"', 'class="rail"')
+        .replace('class="comments"', 'class="talk"')
+        .replace('class="comment"', 'class="reply"')
+        for html in with_container
+    ]
+    # The article paragraphs the selectors find on the pages that have a container
+    reference = [set(quiet(selector_extract, html).split(". ")) for html in with_container]
+
+    for label, pages in (("container", with_container), ("no match", without)):
+        for name, extract in (("selectors", selector_extract), ("density", density_extract)):
+            seconds, outputs = best_of(lambda: quiet(lambda: [extract(html) for html in pages]))
+            size = sum(len(text) for text in outputs) / len(outputs)
+            recall = sum(
+                len(ref & set(text.split(". "))) / len(ref) for ref, text in zip(reference, outputs)
+            ) / len(outputs)
+            print(f"   {label:<10} {name:<10} {seconds * 1000:>7.1f} ms  "
+                  f"avg output {size:>7,.0f} chars  article recall {recall:.0%}")
+
+    # Density mode on a page whose only <article> is a related-story card:
+    # text and stored HTML both come from the story, and no template is learned
+    card = '<article class="card"><a href="/more">Related story</a></article>'
+    pages = [quiet(da_crawler.ParsedPage, html.replace("</body>", card + "</body>"), "https://example.com/a")
+             for html in without[:20]]
+    same = all(
+        quiet(da_crawler.density_clean, page) == da_crawler._article_text(page.content_node)
+        and "Related story" not in quiet(lambda: page.content_html)
+        for page in pages
+    )
+    check("density mode stores the density block", same and not any(page._article_done for page in pages))
+    check("density mode learns no template", da_crawler.TEMPLATES.get("example.com") is None)
+
+
+# ------------------------------
+# ARTICLE TEXT
+# ------------------------------
+
+def legacy_article_text(tree):
+    """manual_clean's old extraction: one tree.css() per tag, any() over the skip patterns."""
+    parts = []
+    h1 = tree.css_first("h1")
+    if h1 and h1.text(strip=True):
+        parts += [h1.text(strip=True), ""]
+    for selector in ["p", "h2", "h3", "h4", "li", "blockquote"]:
+        for elem in tree.css(selector):
+            text = elem.text(strip=True)
+            lower = text.lower()
+            if len(text) < 3 or any(pattern in lower for pattern in da_crawler.SKIP_TEXT_PATTERNS):
+                continue
+            if text.startswith("http") or text.startswith("www"):
+                continue
+            parts.append(text)
+    result = re.sub(r"\s+", " ", "\n\n".join(parts))
+    return re.sub(r"\n\s*\n\s*\n+", "\n\n", result).strip()
+
+
+def bench_article_text(n=200):
+    print(f"[article_text] {n} synthetic article containers")
+    # Quotes and list items wrapping paragraphs - the old loop emitted those
+    # twice - and containers with text of their own around the nested blocks
+    nested = (
+        '<blockquote><p>A quoted paragraph that is long enough to keep.</p>'
+        '<p>And a second quoted paragraph right after it.</p></blockquote>'
+        '<ul><li><p>A list item holding a whole paragraph of text.</p></li></ul>'
+        '<ul><li>A list item with a lead sentence of its own.'
+        '<ul><li>And a nested item under it.</li></ul></li></ul>'
+        '<blockquote>The quote opens with its own text.<p>Then a quoted paragraph follows.</p></blockquote>'
+    )
+    pages = [
+        make_article_html(paragraphs=60, seed=i).replace(
+            '<div class="entry-content">', '<div class="entry-content">' + nested
+        )
+        for i in range(n)
+    ]
+    trees = [da_crawler.HTMLParser(html) for html in pages]  # keep the nodes' trees alive
+    containers = [quiet(da_crawler._find_article_node, tree) for tree in trees]
+
+    complete, ordered, dropped = 0, 0, 0
+    for node in containers:
+        old = legacy_article_text(node)
+        new = da_crawler._article_text(node)
+        # Nothing lost: every word the old output had is still there
+        complete += set(re.split(r"[\s.]+", old)) == set(re.split(r"[\s.]+", new))
+        dropped += len(old) - len(new)
+        # Document order: each sentence is found after the previous one in the container's text
+        full, pos = node.text(strip=True), 0
+        for sentence in (piece.strip() for piece in new.split(".")):
+            pos = full.find(sentence, pos) if pos >= 0 else -1
+        ordered += pos >= 0
+    check("complete", complete == n, f"{complete}/{n}")
+    check("document order", ordered == n, f"{ordered}/{n}")
+    print(f"   duplicate text dropped: {dropped / n:,.0f} chars per page")
+
+    before, _ = best_of(lambda: [legacy_article_text(node) for node in containers])
+    after, _ = best_of(lambda: [da_crawler._article_text(node) for node in containers])
+    report("pages", before, after, n, "pages")
+
+
+# ------------------------------
+# SITE BOILERPLATE
+# ------------------------------
+
+def add_site_chrome(html, seed):
+    """Site-specific blocks under class names JUNK_SELECTORS doesn't know, inside the article."""
+    rnd = random.Random(seed)
+    chrome = (
+        '<div class="promo-box"><h3>Get the morning briefing</h3>'
+        "<p>The day's biggest stories, delivered to your inbox every morning.</p></div>"
+        '<div class="most-read"><h3>Most read this week</h3><ul>'
+        + "".join(f"<li>{sentence(random.Random(i), 5, 9)}</li>" for i in range(5))
+        + "</ul></div>"
+    )
+    # Page-specific teaser lines so not every block repeats
+    teaser = f"<p>{sentence(rnd, 10, 20)}</p>"
+    return html.replace("</article>", chrome + teaser + "</article>")
+
+
+def bench_boilerplate(n=40, discovery_pages=10):
+    print(f"[boilerplate] {discovery_pages} discovery pages, then {n} articles from one site")
+    model = da_crawler.BoilerplateModel()
+    for i in range(discovery_pages):
+        model.observe(da_crawler.HTMLParser(add_site_chrome(make_article_html(5, seed=1000 + i), 1000 + i)))
+
+    pages = [add_site_chrome(make_article_html(paragraphs=30, seed=i), i) for i in range(n)]
+    before_size, after_size, kept = 0, 0, 0
+    for i, html in enumerate(pages):
+        plain = da_crawler.ParsedPage(html, "https://example.com/a")
+        learned = da_crawler.ParsedPage(html, "https://example.com/a", boilerplate=model)
+        before_size += len(quiet(lambda: plain.article_html))
+        after_size += len(quiet(lambda: learned.article_html))
+        # Every article paragraph must survive
+        paragraphs = [p.text(strip=True) for p in da_crawler.HTMLParser(make_article_html(30, seed=i)).css(".entry-content > p")]
+        text = quiet(da_crawler.manual_clean, learned)
+        kept += all(" ".join(p.split()) in text for p in paragraphs)
+
+    check("article paragraphs kept", kept == n, f"{kept}/{n}")
+    print(f"   article HTML sent to cleaning: {before_size / n:,.0f} -> {after_size / n:,.0f} chars per page "
+          f"({1 - after_size / before_size:.0%} less)")
+
+
+# ------------------------------
+# METADATA
+# ------------------------------
+
+def legacy_metadata(html):
+    """extract_metadata as it was: every lookup on a full parse of the page."""
+    tree = da_crawler.HTMLParser(html)
+    title = ""
+    og = tree.css_first("meta[property='og:title']")
+    if og:
+        title = og.attributes.get("content", "")
+    if not title:
+        h1 = tree.css_first("h1")
+        if h1:
+            title = h1.text(strip=True)
+    title = title or "Untitled"
+
+    author = ""
+    for n in tree.css("script[type='application/ld+json']"):
+        try:
+            data = json.loads(n.text(strip=True))
+            if isinstance(data, dict) and "author" in data:
+                if isinstance(data["author"], list):
+                    author = ", ".join(a.get("name", "") for a in data["author"] if "name" in a)
+                else:
+                    author = data["author"].get("name", "")
+        except Exception:
+            pass
+    if not author:
+        meta_author = tree.css_first("meta[name='author']")
+        if meta_author:
+            author = meta_author.attributes.get("content", "")
+    if not author:
+        by = tree.css_first(".byline, .author, .post-author")
+        if by:
+            author = by.text(strip=True).replace("By ", "")
+
+    published = None
+    meta_time = tree.css_first("meta[property='article:published_time']")
+    if meta_time and meta_time.attributes.get("content"):
+        try:
+            published = da_crawler.datetime.fromisoformat(meta_time.attributes["content"])
+        except Exception:
+            pass
+    return title, author, published
+
+
+def metadata_variants(html):
+    """The same page with its metadata moved around - each one exercises another lookup path."""
+    ld = '<script type="application/ld+json">{"@type": "NewsArticle", "author": {"name": "Ld Author"}}</script>'
+    no_og = re.sub(r'<meta property="og:title"[^>]*>', "", html)
+    no_author = html.replace('<meta name="author" content="Jane Reporter">', "")
+    return [
+        html,
+        html.replace("</head>", ld + "</head>"),
+        html.replace("</article>", ld + "</article>"),  # JSON-LD in the body
+        no_og,  # title from the h1
+        no_author.replace("<h1>", '<p class="byline">By Sam Writer</p><h1>'),  # byline
+        no_author.replace("</footer>", '<meta name="author" content="Body Meta"></footer>'),
+        html.replace("<head>", "").replace("</head>", ""),  # no head at all
+        html.replace("</head>", "</HEAD >"),
+    ]
+
+
+def bench_metadata(n=200):
+    print(f"[metadata] {n} synthetic pages x {len(metadata_variants(''))} metadata layouts")
+    pages = [variant for i in range(n) for variant in metadata_variants(make_article_html(30, seed=i))]
+
+    def parsed_first(html):
+        page = da_crawler.ParsedPage(html)
+        page.text  # full tree already built - metadata reads its <head>
+        return page.metadata()
+
+    mismatches = []
+    for i, html in enumerate(pages):
+        title, author, published = legacy_metadata(html)
+        for new in (da_crawler.extract_metadata(html), parsed_first(html)):
+            if new[:2] != (title, author) or (published is not None and new[2] != published):
+                mismatches.append(i)
+    check("parity", not mismatches, f"{len(mismatches)} mismatches, e.g. pages {mismatches[:3]}")
+
+    # Timing on article-sized pages (~150 KB) with the metadata in the head
+    plain = [make_article_html(300, seed=i) for i in range(n // 4)]
+    before, _ = best_of(lambda: [legacy_metadata(html) for html in plain])
+    after, _ = best_of(lambda: [da_crawler.extract_metadata(html) for html in plain])
+    report("pages", before, after, len(plain), "pages")
+
+
+# ------------------------------
+# MARKUP STRIPPING
+# ------------------------------
+
+def legacy_strip_code(html, replacement=""):
+    """The script/style/comment regexes of html_preclean and extract_article_content."""
+    html = re.sub(r"<script[\s\S]*?</script>", replacement, html, flags=re.I)
+    html = re.sub(r"<style[\s\S]*?</style>", replacement, html, flags=re.I)
+    return re.sub(r"<!--.*?-->", replacement, html, flags=re.S)
+
+
+def legacy_strip_page(html):
+    """The regexes strip_html_basic ran before parsing."""
+    html = re.sub(r"<head[\s\S]*?</head>", "", html, flags=re.I)
+    html = re.sub(r"<script[\s\S]*?</script>", "", html, flags=re.I)
+    html = re.sub(r"<style[\s\S]*?</style>", "", html, flags=re.I)
+    html = re.sub(r"<img[\s\S]*?>", "", html, flags=re.I)
+    return re.sub(r"<!--.*?-->", "", html, flags=re.S)
+
+
+STRIP_CASES = [
+    "",
+    "<p>no markup to strip</p>",
+    "<SCRIPT type='text/javascript'>var a = '<b>';</SCRIPT><p>x</p>",
+    "<head><title>t</title><style>p {}</style></head><body><header>h</header><p>x</p></body>",
+    "<p>a<!-- one --> b <!-- two\n lines --> c</p>",
+    "<p>unclosed <script>var a = 1;",
+    "<p>unclosed comment <!-- forever",
+    "<img src='a.png' alt='x'><p>after <IMG\nsrc=b.png></p>",
+    "<script>1</script><script>2</script><style>3</style>tail",
+    "<div><script>if (a < b) {}</script></div>",
+]
+
+
+def bench_markup_stripper(n=200):
+    print(f"[markup_stripper] {n} synthetic pages + {len(STRIP_CASES)} edge cases")
+    pages = [make_article_html(paragraphs=30, seed=i) for i in range(n)] + STRIP_CASES
+    checks = [
+        (lambda h: legacy_strip_code(h), lambda h: da_crawler.CODE_STRIPPER.strip(h)),
+        (lambda h: legacy_strip_code(h, " "), lambda h: da_crawler.CODE_STRIPPER.strip(h, " ")),
+        (legacy_strip_page, da_crawler.PAGE_STRIPPER.strip),
+    ]
+    mismatches = [i for i, html in enumerate(pages) for old, new in checks if old(html) != new(html)]
+    check("parity", not mismatches, f"{len(mismatches)} mismatches, e.g. pages {mismatches[:3]}")
+
+    size = sum(len(html) for html in pages) / 1e6
+    before, _ = best_of(lambda: [legacy_strip_page(html) for html in pages])
+    after, _ = best_of(lambda: [da_crawler.PAGE_STRIPPER.strip(html) for html in pages])
+    report("pages", before, after, size, "MB")
+
+    # Malformed markup: many unclosed <script> tags - each one made the
+    # lazy regex scan to the end of the document
+    html = make_article_html(paragraphs=300) + "<p>tail <script>" * 2000
+    same = legacy_strip_page(html) == da_crawler.PAGE_STRIPPER.strip(html)
+    check("malformed parity", same)
+    before, _ = best_of(lambda: legacy_strip_page(html))
+    after, _ = best_of(lambda: da_crawler.PAGE_STRIPPER.strip(html))
+    report("malformed", before, after, len(html) / 1e6, "MB")
+
+
+# ------------------------------
+# LLM CHUNK CLEANING
+# ------------------------------
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Chat completion endpoint that answers after a fixed delay with the chunk's text."""
+    delay = 0.2
+    fail_every = 0  # answer 500 to chunks whose length is a multiple of this (0: never)
+    requests = 0
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        cls = type(self)
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with cls.lock:
+            cls.requests += 1
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.in_flight -= 1
+
+        content = payload["messages"][-1]["content"]
+        if cls.fail_every and len(content) % cls.fail_every == 0:
+            self.send_response(500)
+            self.end_headers()
+            return
+        text = re.sub(r"<[^>]+>", " ", content)
+        body = json.dumps({"choices": [{"message": {"content": " ".join(text.split())}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def fake_llm(**settings):
+    """Point da_crawler at a local FakeLLMHandler server for the duration of the block."""
+    handler = type("Handler", (FakeLLMHandler,), dict(settings, lock=threading.Lock()))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    old_url = da_crawler.API_URL
+    da_crawler.API_URL = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    try:
+        yield handler
+    finally:
+        da_crawler.API_URL = old_url
+        server.shutdown()
+        server.server_close()
+
+
+def legacy_llm_post(payload):
+    """One blocking POST straight from the calling thread."""
+    return da_crawler.get_http_session().post(
+        da_crawler.API_URL, json=payload,
+        headers={"Authorization": f"Bearer {da_crawler.API_KEY}"}, timeout=200,
+    )
+
+
+def legacy_gpt_summary(text):
+    payload = {
+        "model": da_crawler.MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": da_crawler.SUMMARY_PROMPT},
+            {"role": "user", "content": text[:4000]},
+        ],
+        "temperature": 0.0,
+        "max_tokens": 512,
+    }
+    r = legacy_llm_post(payload)
+    return r.json()["choices"][0]["message"]["content"].strip() if r.status_code == 200 else ""
+
+
+def legacy_gpt_clean(html):
+    """gpt_clean as it was: one chunk at a time, 0.15 s pause after each."""
+    page = da_crawler.ParsedPage(html)
+    chunks = da_crawler.chunk_text(da_crawler.html_preclean(page.article_html))
+    outputs = []
+    for chunk in chunks:
+        r = legacy_llm_post(da_crawler.chunk_payload(chunk))
+        outputs.append(da_crawler.chunk_result(r, chunk))
+        time.sleep(0.15)
+    result = da_crawler.clean_llm_artifacts("\n".join(outputs))
+    result = re.sub(r"<[^>]+>", "", result)
+    return re.sub(r"\s+", " ", result).strip()
+
+
+def bench_llm_chunks(n=3):
+    html = make_article_html(paragraphs=300)
+    article_html = quiet(lambda: da_crawler.ParsedPage(html).article_html)
+    chunks = len(da_crawler.chunk_text(da_crawler.html_preclean(article_html)))
+    print(f"[llm_chunks] {n} articles of {chunks} chunks, fake LLM answering in {FakeLLMHandler.delay:.1f}s")
+
+    for fail_every in (0, 3):
+        with fake_llm(fail_every=fail_every):
+            same = quiet(legacy_gpt_clean, html) == quiet(da_crawler.gpt_clean, html)
+        label = "parity" if not fail_every else "parity with failing chunks"
+        check(label, same)
+
+    with fake_llm() as server:
+        before, _ = best_of(lambda: [quiet(legacy_gpt_clean, html) for _ in range(n)], repeat=1)
+        server.peak = 0
+        after, _ = best_of(lambda: [quiet(da_crawler.gpt_clean, html) for _ in range(n)], repeat=1)
+        print(f"   peak requests in flight: {server.peak} (limit {da_crawler.LLM_MAX_CONCURRENCY})")
+        check("concurrency limit", server.peak <= da_crawler.LLM_MAX_CONCURRENCY, f"{server.peak} in flight")
+    report("articles", before, after, n, "articles")
+
+
+def bench_llm_dispatch(sites=4, articles=4):
+    print(f"[llm_dispatch] {sites} sites crawling at once, {articles} articles each (clean + summary)")
+    pages = [make_article_html(paragraphs=100, seed=i) for i in range(sites * articles)]
+
+    def crawl(clean, summarize):
+        """Each site handles its articles one after another, like crawl_site."""
+        results = [None] * len(pages)
+
+        def site(first):
+            for i in range(first, len(pages), sites):
+                text = clean(pages[i])
+                results[i] = (text, summarize(text))
+
+        # Silenced once around all threads - redirect_stdout is process-wide
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=site, args=(first,)) for first in range(sites)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        return results
+
+    with fake_llm() as server:
+        before, old = best_of(lambda: crawl(legacy_gpt_clean, legacy_gpt_summary), repeat=1)
+        old_peak, server.peak = server.peak, 0
+        after, new = best_of(lambda: crawl(da_crawler.gpt_clean, da_crawler.gpt_summary), repeat=1)
+        check("parity", old == new)
+        print(f"   peak requests in flight: {old_peak} -> {server.peak} (limit {da_crawler.LLM_MAX_CONCURRENCY})")
+        check("concurrency limit", server.peak <= da_crawler.LLM_MAX_CONCURRENCY, f"{server.peak} in flight")
+    stats = da_crawler.LLM.stats()
+    print(f"   dispatcher: {stats['sent']} requests, avg queue wait {stats['avg_wait'] * 1000:.0f} ms")
+    report("articles", before, after, len(pages), "articles")
+
+
+def bench_llm_cache(n=4):
+    pages = [make_article_html(paragraphs=150, seed=i) for i in range(n)]
+    print(f"[llm_cache] {n} articles cleaned and summarized, then re-crawled")
+
+    def crawl():
+        texts = [quiet(da_crawler.gpt_clean, html) for html in pages]
+        return [(text, quiet(da_crawler.gpt_summary, text)) for text in texts]
+
+    da_crawler.LLM_CACHE = da_crawler.LLMCache(":memory:")
+    with fake_llm() as server:
+        before, first = best_of(crawl, repeat=1)
+        sent, server.requests = server.requests, 0
+        after, second = best_of(crawl, repeat=1)
+        check("parity", first == second)
+        print(f"   LLM requests: {sent} -> {server.requests}")
+    stats = da_crawler.LLM_CACHE.stats()
+    print(f"   cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes'] / 1e3:.0f} KB")
+    report("articles", before, after, n, "articles")
+
+    # Eviction: past the cap, the least recently used answers go first
+    cache = da_crawler.LLMCache(":memory:", max_bytes=stats["bytes"] // 2)
+    answers = {}
+    for i in range(200):
+        text = sentence(random.Random(i), 300, 400)
+        answers[text] = text.upper()
+        cache.put("model", "prompt", text, answers[text])
+    recent = list(answers)[-20:]
+    kept = sum(cache.get("model", "prompt", text) == answers[text] for text in recent)
+    print(f"   eviction: {cache.stats()['bytes']:,} of {cache.max_bytes:,} bytes used, {cache.evicted} evicted")
+    check("most recent kept", kept == len(recent), f"{kept}/{len(recent)}")
+
+
+# ------------------------------
+# CHUNKING
+# ------------------------------
+
+def legacy_chunk_text(text, max_len=8000):
+    """chunk_text as it was: fixed 8000-character slices."""
+    return [text[start:start + max_len] for start in range(0, len(text), max_len)]
+
+
+def chunk_damage(chunks):
+    """(chunk ends cut inside a tag, chunk ends cut mid-block) for a list of chunks."""
+    in_tag = mid_block = 0
+    for chunk, following in zip(chunks, chunks[1:]):
+        if chunk.rfind("<") > chunk.rfind(">"):
+            in_tag += 1
+        elif not da_crawler._BLOCK_START.match(following):
+            mid_block += 1
+    return in_tag, mid_block
+
+
+def bench_chunking(n=100):
+    print(f"[chunking] {n} cleaned articles of 50-400 paragraphs, budget {da_crawler.llm_chunk_budget()} tokens")
+    rnd = random.Random(7)
+    htmls = [make_article_html(paragraphs=rnd.randint(50, 400), seed=i) for i in range(n)]
+    texts = quiet(lambda: [da_crawler.html_preclean(da_crawler.ParsedPage(html).article_html) for html in htmls])
+
+    before, old = best_of(lambda: [legacy_chunk_text(text) for text in texts])
+    after, new = best_of(lambda: [da_crawler.chunk_text(text) for text in texts])
+
+    lossless = all("".join(chunks) == text for chunks, text in zip(new, texts))
+    budget = da_crawler.llm_chunk_budget()
+    over = sum(da_crawler.count_tokens(chunk) > budget for chunks in new for chunk in chunks)
+    check("lossless", lossless)
+    check("chunks within budget", not over, f"{over} over")
+    for name, result in (("before", old), ("after", new)):
+        count = sum(len(chunks) for chunks in result)
+        in_tag, mid_block = map(sum, zip(*(chunk_damage(chunks) for chunks in result)))
+        print(f"   {name:<7} {count} LLM calls, {in_tag} cuts inside a tag, {mid_block} mid-block")
+
+    # Pluggable tokenizer: one token per character
+    old_tokenizer = da_crawler.LLM_TOKENIZER
+    da_crawler.LLM_TOKENIZER = len
+    try:
+        chunks = da_crawler.chunk_text(texts[0], max_tokens=2000)
+    finally:
+        da_crawler.LLM_TOKENIZER = old_tokenizer
+    print(f"   LLM_TOKENIZER=len, 2000 tokens: {len(chunks)} chunks, longest {max(map(len, chunks))} chars")
+    # Token counting costs CPU; it is small next to one LLM call saved
+    print(f"   time per article: {before / n * 1000:.2f} ms -> {after / n * 1000:.2f} ms")
+
+
+# ------------------------------
+# CLEANING ROUTER
+# ------------------------------
+
+def make_hard_page(kind, seed=1):
+    """Pages manual_clean gets wrong: no container, a link list, a stub, text in <div>s."""
+    rnd = random.Random(seed)
+    html = make_article_html(paragraphs=30, seed=seed)
+    if kind == "no_container":
+        # Story in anonymous <div>s with <br> breaks - no selector or <p> to find it
+        story = "<br><br>".join(sentence(rnd, 20, 40) for _ in range(30))
+        return re.sub(r"<main>.*</main>", f'<div class="x9"><div class="x10">{story}</div></div>', html, flags=re.S)
+    if kind == "link_list":
+        links = "".join(f'<p><a href="/2024/{i}/story">{sentence(rnd, 6, 12)}</a></p>' for i in range(40))
+        return re.sub(r'<div class="entry-content">.*?</div>\n<div class="share',
+                      f'<div class="entry-content">{links}</div>\n<div class="share', html, flags=re.S)
+    if kind == "stub":
+        return re.sub(r'<div class="entry-content">.*?</div>\n<div class="share',
+                      f'<div class="entry-content"><p>{sentence(rnd)}</p></div>\n<div class="share', html, flags=re.S)
+    return html
+
+
+def bench_cleaning_router(n=40):
+    kinds = ["article"] * 4 + ["no_container", "link_list", "stub"]
+    pages = [(kinds[i % len(kinds)], make_hard_page(kinds[i % len(kinds)], seed=i)) for i in range(n)]
+    counts = {kind: sum(1 for k, _ in pages if k == kind) for kind in dict.fromkeys(kinds)}
+    print(f"[cleaning_router] {n} pages: {', '.join(f'{count} {kind}' for kind, count in counts.items())}")
+
+    with fake_llm() as server:
+        before, _ = best_of(lambda: [quiet(da_crawler.gpt_clean, html) for _, html in pages], repeat=1)
+        sent, server.requests = server.requests, 0
+        router = da_crawler.CleaningRouter("bench")
+        routes = []
+
+        def routed():
+            for kind, html in pages:
+                calls = router.llm
+                quiet(router, html)
+                routes.append((kind, router.llm > calls))
+
+        after, _ = best_of(routed, repeat=1)
+        print(f"   LLM requests: {sent} -> {server.requests}")
+
+    for kind, count in counts.items():
+        escalated = sum(llm for k, llm in routes if k == kind)
+        print(f"   {kind:<13} sent to the LLM: {escalated}/{count}")
+    print(f"   saved: {router.saved_calls} LLM calls (~{router.saved_tokens:,} tokens)")
+    report("pages", before, after, n, "pages")
+
+
+BENCHMARKS = {
+    "url_classifier": bench_url_classifier,
+    "canonical_urls": bench_canonical_urls,
+    "parsed_page": bench_parsed_page,
+    "junk_removal": bench_junk_removal,
+    "markup_stripper": bench_markup_stripper,
+    "article_templates": bench_article_templates,
+    "density_extraction": bench_density_extraction,
+    "article_text": bench_article_text,
+    "boilerplate": bench_boilerplate,
+    "metadata": bench_metadata,
+    "chunking": bench_chunking,
+    "llm_chunks": bench_llm_chunks,
+    "llm_dispatch": bench_llm_dispatch,
+    "llm_cache": bench_llm_cache,
+    "cleaning_router": bench_cleaning_router,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    failed = []
+    for name in args.names or BENCHMARKS:
+        # Fresh in-memory extraction templates - never the crawler's cache file
+        da_crawler.TEMPLATES = da_crawler.TemplateCache()
+        # No LLM answer cache unless the benchmark sets one up
+        da_crawler.LLM_CACHE = da_crawler.LLMCache(None)
+        count = len(FAILURES)
+        BENCHMARKS[name]()
+        if len(FAILURES) > count:
+            failed.append(name)
+        print()
+
+    if failed:
+        sys.exit(f"failed checks in: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
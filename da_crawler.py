@@ -3,23 +3,55 @@
 
 
 Configuration:
- • USE_LLM_CLEANING — Toggle between LLM (True) or manual (False) cleaning
+ • USE_LLM_CLEANING — True: "auto" (LLM only when manual looks poor), False: manual only
+ • CLEANING_MODE — "auto" (manual, LLM when unsure), "llm", "manual" or "density"
+ • CLEAN_MIN_QUALITY — Score a manual result needs to skip the LLM in "auto" mode
  • JUNK_SELECTORS — Add HTML elements/classes to remove during cleaning
  • URL_EXCLUDE_PATTERNS — Add URL patterns to hard exclude (never visit)
+ • URL_SECTION_PATTERNS — Add URL patterns for section pages (visit, never an article)
+ • TRACKING_PARAMS / CANONICAL_URL_RULES — URL canonicalization (per-site overrides)
+ • DISCOVERY_MODE — "auto" (RSS/Atom feed, then sitemaps, then BFS), "feed", "sitemap" or "bfs"
+ • DISCOVERY_MAX_CONCURRENCY / DISCOVERY_PER_HOST_CONCURRENCY — In-flight discovery requests
+ • CRAWL_STATE_PATH / CHECKPOINT_EVERY — Discovery checkpoints for --resume
+ • TEMPLATE_CACHE_PATH — Per-site article container selectors (TEMPLATE_* tuning)
+ • BOILERPLATE_MIN_PAGES / BOILERPLATE_MIN_SHARE — Learned per-site repeated-block removal
+ • POLITENESS_DELAY / RESPECT_CRAWL_DELAY — Per-host spacing between requests
+ • MAX_CONCURRENT_SITES — How many sites are crawled at the same time
+ • HTTP_POOL_MAXSIZE / HTTP_POOL_OVERRIDES — Keep-alive connection pool sizes
+ • MAX_PAGE_BYTES / HTML_CONTENT_TYPES — Size cap and accepted types for page fetches
+ • ROBOTS_MAX_BYTES — Size cap for robots.txt (a larger one counts as missing)
+ • SITEMAP_MAX_BYTES — Size cap per sitemap file, counted after gunzip
+ • LLM_MAX_CONCURRENCY — LLM requests kept in flight by the shared dispatch queue
+ • LLM_CACHE_PATH / LLM_CACHE_MAX_MB — Persistent cache of LLM answers (None: off)
+ • LLM_CONTEXT_TOKENS / LLM_TOKENIZER — Model token limit and counter for chunking
 """
 
 import argparse
 import asyncio
+import codecs
 import hashlib
+import heapq
 import json
 import os
+import queue
 import random
 import re
+import sqlite3
+import sys
+import threading
 import time
-from datetime import datetime
-from urllib.parse import urlparse, urljoin
+import xml.etree.ElementTree as ET
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import unquote_plus, urldefrag, urljoin, urlparse, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
 
 import requests
+from requests.adapters import HTTPAdapter
 from selectolax.parser import HTMLParser
 from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import insert as pg_insert
@@ -30,10 +62,28 @@ from app.models import Blog, Post
 # ------------------------------
 # CLEANING METHOD CONFIGURATION
 # ------------------------------
-# Set to False to use manual HTML parsing instead of LLM
+# True selects "auto": manual parsing first, the LLM only for pages where that
+# looks poor. (It used to send every page to the LLM - for that, set
+# CLEANING_MODE = "llm" or run with --cleaning llm.)
+# Set to False to use manual HTML parsing only
 # LLM can hallucinate - manual parsing is more reliable but less sophisticated
 USE_LLM_CLEANING = True  # Change to False if LLM adds unwanted content
 
+# Or pick the cleaning method directly:
+#   "llm"     — gpt_clean, LLM cleaning of the article container
+#   "manual"  — manual_clean, text of the article container found by selectors
+#   "density" — density_clean, text of the block with the best text density
+#   "auto"    — manual_clean, and gpt_clean only for pages where it looks poor
+CLEANING_MODE = "auto" if USE_LLM_CLEANING else "manual"
+
+# "auto" keeps the manual_clean result when its quality score (0-1, see
+# clean_quality) reaches CLEAN_MIN_QUALITY. The score drops with fewer than
+# CLEAN_MIN_PARAGRAPHS real paragraphs, less than CLEAN_MIN_CHARS of text,
+# link-heavy or chrome-heavy containers and a whole-<body> fallback container.
+CLEAN_MIN_QUALITY = 0.6
+CLEAN_MIN_PARAGRAPHS = 3
+CLEAN_MIN_CHARS = 600
+
 
 # ------------------------------
 # JUNK REMOVAL CONFIGURATION
@@ -120,6 +170,229 @@ URL_EXCLUDE_PATTERNS = [
     # r"/exclude-this-path/",
 ]
 
+# ------------------------------
+# SECTION PAGE PATTERNS
+# ------------------------------
+# Regex patterns for SOFT EXCLUDES - section/category pages.
+# The crawler visits them to find article links, but never marks them as articles.
+#
+URL_SECTION_PATTERNS = [
+    r"/category/?$",
+    r"/categories/?$",
+    r"/tag/?$",
+    r"/tags/?$",
+    r"/topics?/?$",
+    r"/archive/?$",
+    r"/archives/?$",
+    r"/\d{4}/?$",           # Just year: /2023/
+    r"/\d{4}/\d{2}/?$",     # Just year/month: /2023/08/
+    r"/hub/?$",
+    r"/all-articles/?$",
+    r"/news/?$",            # Section page, not article
+    r"/world-news/?$",
+    r"/politics/?$",
+    r"/opinion/?$",
+    r"/sports/?$",
+    r"/tech/?$",
+    r"/business/?$",
+    r"/story/?$",           # Story section, not article
+
+    # ADD YOUR CUSTOM PATTERNS BELOW:
+    # r"/section-name/?$",
+]
+
+# ------------------------------
+# URL CANONICALIZATION
+# ------------------------------
+# Every discovered/crawled URL is keyed on one canonical form for dedup and as
+# the stored post key, so fragments, tracking params, http vs https and host
+# case no longer produce separate entries. Requests still go to the URL as it
+# was discovered (or redirected to), so canonicalizing never costs a redirect.
+#
+# Query parameters to drop (regex, matched against the whole param name)
+TRACKING_PARAMS = [
+    r"utm_\w+",
+    r"fbclid", r"gclid", r"dclid", r"gclsrc", r"msclkid", r"yclid",
+    r"mc_cid", r"mc_eid", r"igshid", r"_ga", r"_hsenc", r"_hsmi", r"mkt_tok",
+    r"ref", r"ref_src", r"cmpid", r"ocid",
+
+    # ADD YOUR CUSTOM PARAMS BELOW:
+    # r"campaign_\w+",
+]
+
+DEFAULT_CANONICAL_RULES = {
+    "scheme": "https",          # http and https variants share one key; None keeps them apart
+    "strip_www": False,         # www.example.com -> example.com
+    "trailing_slash": "keep",   # "strip", "keep" or "add"
+    "strip_params": TRACKING_PARAMS,
+    "keep_params": None,        # list of regexes - if set, every other param is dropped
+    "sort_params": True,
+    "keep_fragment": False,
+}
+
+# Per-site overrides, keyed by host. A "canonical_rules" object on a site
+# entry in the sites file is applied on top of these.
+#
+# Example:
+#   "www.example.com": {"trailing_slash": "strip", "keep_params": [r"id"]},
+#
+CANONICAL_URL_RULES = {
+}
+
+
+# ------------------------------
+# DISCOVERY MODE
+# ------------------------------
+# "auto"    — read the site's RSS/Atom feed (rss_url) first, then its sitemaps,
+#             and only BFS-crawl when both together give fewer than
+#             FEED_MIN_ARTICLES entries
+# "feed"    — feed only, never BFS-crawl
+# "sitemap" — sitemaps only (from robots.txt, else /sitemap.xml)
+# "bfs"     — always BFS-crawl the site
+#
+DISCOVERY_MODE = "auto"
+FEED_MIN_ARTICLES = 5
+
+SITEMAP_MAX_AGE_DAYS = 30   # skip sitemap entries with an older lastmod (None = no limit)
+SITEMAP_MAX_FILES = 50      # max sitemap files fetched per site
+
+
+# ------------------------------
+# DISCOVERY CONCURRENCY
+# ------------------------------
+# Discovery fetches several pages at once instead of one at a time.
+# Pages are still processed in BFS order, so the article set is the same
+# as a sequential crawl - only the idle waiting goes away.
+#
+# DISCOVERY_MAX_CONCURRENCY — max requests in flight overall
+# DISCOVERY_PER_HOST_CONCURRENCY — max requests in flight to a single host
+#
+DISCOVERY_MAX_CONCURRENCY = 8
+DISCOVERY_PER_HOST_CONCURRENCY = 4
+
+
+# ------------------------------
+# POLITENESS
+# ------------------------------
+# Requests to the same host (BFS discovery, feeds, sitemaps, robots.txt and
+# article fetches) start at least POLITENESS_DELAY seconds apart - a random
+# value in the (min, max) range.
+# Only the work waiting for that host pauses; other hosts keep going.
+# With RESPECT_CRAWL_DELAY, a larger robots.txt Crawl-delay wins.
+#
+POLITENESS_DELAY = (0.4, 1.0)  # Be nice to servers
+RESPECT_CRAWL_DELAY = True
+
+
+# ------------------------------
+# MULTI-SITE CRAWLING
+# ------------------------------
+# Sites from the sites file are crawled concurrently, at most
+# MAX_CONCURRENT_SITES at a time. Each site has its own DB session and a
+# failing site is logged and skipped without affecting the others.
+#
+MAX_CONCURRENT_SITES = 8
+
+
+# ------------------------------
+# CRAWL STATE (resume)
+# ------------------------------
+# BFS discovery checkpoints its frontier, visited pages and article URLs to a
+# local SQLite file every CHECKPOINT_EVERY pages. Run with --resume to pick up
+# an interrupted discovery instead of starting the site over.
+#
+CRAWL_STATE_PATH = "crawl_state.sqlite3"
+CHECKPOINT_EVERY = 25
+
+
+# ------------------------------
+# EXTRACTION TEMPLATES
+# ------------------------------
+# A site renders every article with the same template, so the container
+# selector that wins on one page wins on the next. Per domain, the winning
+# selector is remembered in TEMPLATE_CACHE_PATH. Junk removal always runs in full.
+#
+# TEMPLATE_MIN_PAGES — wins needed before a selector is tried first (one query per page)
+# TEMPLATE_WINDOW — lookups between full searches and hit rate checks; a full
+#                   search won by another selector means the site changed, and
+#                   the domain's template is learned again right away
+# TEMPLATE_MIN_HIT_RATE — below this the domain's template is learned again
+#
+TEMPLATE_CACHE_PATH = "extraction_templates.json"
+TEMPLATE_MIN_PAGES = 3
+TEMPLATE_WINDOW = 20
+TEMPLATE_MIN_HIT_RATE = 0.8
+
+
+# ------------------------------
+# SITE BOILERPLATE
+# ------------------------------
+# Text blocks (paragraphs, list items, headings, quotes) are fingerprinted on
+# every page of a site - BFS discovery pages and the articles themselves.
+# A block that shows up on most pages is site chrome JUNK_SELECTORS doesn't
+# know about ("Get our daily newsletter", "Most read" lists, ...) and is
+# removed from the article container before cleaning.
+#
+# BOILERPLATE_MIN_PAGES — pages seen before anything counts as boilerplate
+# BOILERPLATE_MIN_SHARE — share of those pages a block must be on
+# BOILERPLATE_MAX_REMOVED — never remove more than this share of an article's text
+#
+BOILERPLATE_MIN_PAGES = 5
+BOILERPLATE_MIN_SHARE = 0.5
+BOILERPLATE_MAX_REMOVED = 0.5
+
+
+# ------------------------------
+# HTTP CONNECTION POOLS
+# ------------------------------
+# All requests share one keep-alive session (see get_http_session).
+#
+# HTTP_POOL_HOSTS — how many hosts keep an open connection pool
+# HTTP_POOL_MAXSIZE — connections kept open per host
+# HTTP_POOL_OVERRIDES — per-host pool sizes, e.g. {"www.example.com": 16}
+# LLM_POOL_MAXSIZE — pool size for the LLM API host (API_URL)
+#
+HTTP_POOL_HOSTS = 100
+HTTP_POOL_MAXSIZE = DISCOVERY_MAX_CONCURRENCY
+HTTP_POOL_OVERRIDES = {
+}
+LLM_POOL_MAXSIZE = 16
+
+DISCOVERY_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# More complete headers for article fetches to avoid being blocked
+ARTICLE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Cache-Control': 'max-age=0',
+}
+
+
+# ------------------------------
+# FETCH LIMITS
+# ------------------------------
+# Article, discovery, feed and robots.txt fetches are streamed. Responses of
+# an unexpected type or larger than the cap are dropped - from the headers when
+# the server sends Content-Type/Content-Length, otherwise as soon as the cap is
+# hit. Responses without a Content-Type are accepted.
+# Sitemaps are capped after gunzip, so a small .xml.gz cannot unpack to an
+# unbounded body; the rest of an oversized sitemap is skipped.
+#
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+ROBOTS_MAX_BYTES = 500 * 1024
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024  # the sitemaps.org limit per file, unpacked
+
 
 # ------------------------------
 # LLM CLEANING & SUMMARIZATION
@@ -128,6 +401,26 @@ API_URL = "Your llm api url"
 MODEL_NAME = "model name"
 API_KEY = "empty"
 
+# Requests in flight at once. Cleaning chunks and summaries of every article
+# and site share one queue (see LLMDispatcher); size this to the batch the
+# inference server runs per step, and keep LLM_POOL_MAXSIZE at least as big
+LLM_MAX_CONCURRENCY = 8
+
+# Cleaned chunks and summaries are cached by (model, prompt, text), so re-crawls
+# and retries don't pay for content that was already sent. Least recently used
+# answers go first once the cache is over LLM_CACHE_MAX_MB. None disables it.
+LLM_CACHE_PATH = "llm_cache.sqlite3"
+LLM_CACHE_MAX_MB = 256
+
+# Cleaning input is chunked by tokens: each chunk gets what is left of
+# MODEL_NAME's context window (LLM_CONTEXT_TOKENS) after the prompt and the
+# answer (LLM_CLEAN_MAX_TOKENS). LLM_TOKENIZER counts tokens - a callable
+# text -> int, e.g. lambda s: len(tokenizer.encode(s)) with the model's own
+# tokenizer. None uses estimate_tokens, a rough count that errs high.
+LLM_CONTEXT_TOKENS = 8192
+LLM_CLEAN_MAX_TOKENS = 4096
+LLM_TOKENIZER = None
+
 CLEANING_PROMPT = """
 You are a text extractor. Extract ONLY the article text from the HTML.
 
@@ -161,27 +454,151 @@ SUMMARY_PROMPT = """
 Summarize this article in 2–3 sentences. Focus on the main idea only.
 """
 
-def chunk_text(text, max_len=8000):
+_TOKEN_PIECES = re.compile(r"\w{1,6}|\S")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: word pieces of up to 6 characters plus each punctuation mark."""
+    return len(_TOKEN_PIECES.findall(text))
+
+
+def count_tokens(text: str) -> int:
+    return (LLM_TOKENIZER or estimate_tokens)(text)
+
+
+def llm_chunk_budget() -> int:
+    """Tokens a cleaning chunk may use: the context window minus prompt, answer and chat markup."""
+    return LLM_CONTEXT_TOKENS - LLM_CLEAN_MAX_TOKENS - count_tokens(CLEANING_PROMPT) - 64
+
+
+# Chunks are cut before a block element; a block too big for one chunk is
+# cut between tags and sentences, and a sentence too big between words
+_BLOCK_START = re.compile(
+    r"(?=<(?:p|h[1-6]|li|ul|ol|dl|dt|dd|blockquote|pre|table|tr|figure|section|div|hr)\b)", re.I
+)
+_TAG = re.compile(r"(<[^>]*>)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])(?=\s)")
+_WORD_START = re.compile(r"(?=\s)")
+
+
+def _split_markup(text: str):
+    for part in _TAG.split(text):
+        if part.startswith("<"):
+            yield part
+        else:
+            yield from _SENTENCE_END.split(part)
+
+
+_SPLITTERS = (_BLOCK_START.split, _split_markup, _WORD_START.split)
+
+
+def _chunk_pieces(text: str, budget: int, level: int = 0):
+    """(piece, tokens) pairs in order, each within budget unless it is a single word."""
+    for piece in _SPLITTERS[level](text):
+        if not piece:
+            continue
+        tokens = count_tokens(piece)
+        if tokens > budget and level + 1 < len(_SPLITTERS):
+            yield from _chunk_pieces(piece, budget, level + 1)
+        else:
+            yield piece, tokens
+
+
+def chunk_text(text, max_tokens=None):
     """
-    Split large HTML pages so GPT-OSS never rejects request size.
+    Split cleaned article HTML so GPT-OSS never rejects request size: chunks
+    of up to max_tokens (default llm_chunk_budget()), packed as full as they
+    go and cut only between blocks - paragraphs, headings, list items.
+    The chunks join back to exactly `text`.
     """
+    budget = max_tokens or llm_chunk_budget()
     chunks = []
-    start = 0
-    length = len(text)
+    parts = []
+    used = 0
+
+    for piece, tokens in _chunk_pieces(text, budget):
+        if parts and used + tokens > budget:
+            chunks.append("".join(parts))
+            parts = []
+            used = 0
+        parts.append(piece)
+        used += tokens
+
+    if parts:
+        chunks.append("".join(parts))
+    return chunks
 
-    while start < length:
-        end = start + max_len
-        chunks.append(text[start:end])
-        start = end
 
-    return chunks
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+class MarkupStripper:
+    """
+    Drops whole <head>/<script>/<style> elements, comments and <img> tags from
+    raw HTML in one linear scan. Replaces the lazy `<script[\\s\\S]*?</script>`
+    style regexes, which rescanned the document once per pattern - and, on an
+    unclosed element, once per opening tag.
+    """
+
+    BLOCKS = {
+        "head": ("<head", "</head>"),
+        "script": ("<script", "</script>"),
+        "style": ("<style", "</style>"),
+        "img": ("<img", ">"),
+        "comment": ("<!--", "-->"),
+    }
+    TAG_NAME_END = frozenset(" \t\n\r\f/>")
+
+    def __init__(self, *kinds):
+        self.rules = [self.BLOCKS[kind] for kind in kinds]
+
+    def _find_open(self, lower: str, opener: str, pos: int) -> int:
+        """Next opener at or after pos; `<head` must not match `<header`."""
+        while True:
+            i = lower.find(opener, pos)
+            end = i + len(opener)
+            if i == -1 or opener == "<!--" or end == len(lower) or lower[end] in self.TAG_NAME_END:
+                return i
+            pos = i + 1
+
+    def strip(self, html: str, replacement: str = "") -> str:
+        # ASCII-only lowering keeps indexes aligned with the original string
+        lower = html.translate(_ASCII_LOWER)
+        active = [[self._find_open(lower, opener, 0), opener, closer] for opener, closer in self.rules]
+        active = [rule for rule in active if rule[0] != -1]
+        out = []
+        pos = 0
+
+        while active:
+            rule = min(active)  # earliest opener wins
+            start, opener, closer = rule
+            end = lower.find(closer, start + len(opener))
+            if end == -1:
+                # Unclosed - no later opener of this kind can close either
+                active.remove(rule)
+                continue
+
+            out.append(html[pos:start])
+            out.append(replacement)
+            pos = end + len(closer)
+            for rule in active:
+                if rule[0] < pos:
+                    rule[0] = self._find_open(lower, rule[1], pos)
+            active = [rule for rule in active if rule[0] != -1]
+
+        out.append(html[pos:])
+        return "".join(out)
+
+
+# Scripts, styles and comments - for HTML that is kept or sent to the LLM
+CODE_STRIPPER = MarkupStripper("script", "style", "comment")
+# Also the whole <head> and images - for plain text extraction
+PAGE_STRIPPER = MarkupStripper("head", "script", "style", "img", "comment")
 
 
 def html_preclean(html: str) -> str:
     """Strip script/style/comments so GPT-OSS does not choke."""
-    html = re.sub(r"<script[\s\S]*?</script>", " ", html, flags=re.I)
-    html = re.sub(r"<style[\s\S]*?</style>", " ", html, flags=re.I)
-    html = re.sub(r"<!--.*?-->", " ", html, flags=re.S)
+    html = CODE_STRIPPER.strip(html, " ")
     html = re.sub(r"\s+", " ", html)
     return html.strip()
 
@@ -221,60 +638,241 @@ def clean_llm_artifacts(text: str) -> str:
     return text.strip()
 
 
-def gpt_clean(html: str) -> str:
+class LLMDispatcher:
+    """
+    One queue for every LLM request of the crawl - cleaning chunks and
+    summaries from all articles and sites in flight. `workers` threads take
+    requests off the queue, so up to that many are at the server at once and
+    its batch stays full while there is work; callers get a Future back.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.waited = 0.0
+
+    def submit(self, payload: dict, timeout: float = 200) -> Future:
+        """Queue a chat completion request; the Future resolves to the requests.Response."""
+        self._start()
+        future = Future()
+        self.jobs.put((payload, timeout, future, time.monotonic()))
+        return future
+
+    def post(self, payload: dict, timeout: float = 200) -> requests.Response:
+        """submit() and wait for the response."""
+        return self.submit(payload, timeout).result()
+
+    def _start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                t = threading.Thread(target=self._work, name=f"llm-{len(self.threads)}", daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def _work(self):
+        while True:
+            payload, timeout, future, queued = self.jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue  # the article gave up on this chunk
+
+            with self.lock:
+                self.waited += time.monotonic() - queued
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            try:
+                r = get_http_session().post(
+                    API_URL,
+                    json=payload,
+                    headers={"Authorization": f"Bearer {API_KEY}"},
+                    timeout=timeout
+                )
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                future.set_exception(e)
+            else:
+                future.set_result(r)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.sent += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "sent": self.sent,
+                "errors": self.errors,
+                "queued": self.jobs.qsize(),
+                "peak_in_flight": self.peak,
+                "avg_wait": self.waited / self.sent if self.sent else 0.0,
+            }
+
+
+LLM = LLMDispatcher(LLM_MAX_CONCURRENCY)
+
+
+class LLMCache:
+    """
+    SQLite-backed LLM answers keyed by a hash of (model, prompt, text), with
+    least-recently-used eviction past max_bytes. Only good answers are stored -
+    failed or empty responses are asked again next time. The file is opened
+    on first use; path None turns the cache off.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._size = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, prompt: str, text: str) -> str:
+        h = hashlib.sha256()
+        for part in (model, prompt, text):
+            data = part.encode("utf-8")
+            h.update(len(data).to_bytes(8, "big"))
+            h.update(data)
+        return h.hexdigest()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY, value TEXT NOT NULL,
+                        size INTEGER NOT NULL, used_at REAL NOT NULL
+                    )
+                """)
+                self._conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used_at)")
+            self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return self._conn
+
+    def get(self, model: str, prompt: str, text: str):
+        """The cached answer, or None."""
+        if self.path is None:
+            return None
+        key = self.key(model, prompt, text)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with conn:
+                conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, model: str, prompt: str, text: str, value: str):
+        if self.path is None:
+            return
+        key = self.key(model, prompt, text)
+        size = len(key) + len(value.encode("utf-8"))
+        with self._lock, self._connect() as conn:
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, used_at) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        """Drop least recently used answers until the cache is back under max_bytes."""
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY used_at"):
+            if self._size <= self.max_bytes:
+                break
+            doomed.append((key,))
+            self._size -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.evicted += len(doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted, "bytes": self._size}
+
+
+LLM_CACHE = LLMCache(LLM_CACHE_PATH)
+
+
+def chunk_payload(chunk: str) -> dict:
+    return {
+        "model": MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": CLEANING_PROMPT},
+            {"role": "user", "content": chunk}
+        ],
+        "temperature": 0.0,
+        "max_tokens": LLM_CLEAN_MAX_TOKENS
+    }
+
+
+def chunk_result(r: requests.Response, chunk: str) -> str:
+    """The LLM's text for a chunk; strip_html_basic output if it failed or came back empty."""
+    if r.status_code != 200:
+        print("      ⚠️ Gemma chunk failed — fallback")
+        return strip_html_basic(chunk)
+
+    content = (
+        r.json()
+          .get("choices", [{}])[0]
+          .get("message", {})
+          .get("content", "")
+          .strip()
+    )
+
+    if not content:
+        print("      ⚠️ Gemma returned empty — fallback")
+        return strip_html_basic(chunk)
+    LLM_CACHE.put(MODEL_NAME, CLEANING_PROMPT, chunk, content)
+    return content
+
+
+def gpt_clean(html) -> str:
     """
     Use Gemma LLM to clean article content from HTML.
+    Accepts raw HTML or a ParsedPage.
+    Chunks go to the shared LLM queue together and are joined in order.
     """
+    page = as_parsed_page(html)
     try:
         # STEP 1: Extract ONLY the article content area first
-        article_html = extract_article_content(html)
-        print(f"   [EXTRACT] Reduced HTML from {len(html)} to {len(article_html)} chars")
+        article_html = page.article_html
+        print(f"   [EXTRACT] Reduced HTML from {len(page.html)} to {len(article_html)} chars")
         
         # STEP 2: Pre-clean the extracted article HTML
         clean_input = html_preclean(article_html)
-        chunks = chunk_text(clean_input, max_len=8000)
-        outputs = []
+        chunks = chunk_text(clean_input)
 
+        # Chunks cleaned before come from the cache; the rest are queued at
+        # once and their results collected in chunk order
+        outputs = [LLM_CACHE.get(MODEL_NAME, CLEANING_PROMPT, chunk) for chunk in chunks]
+        futures = {}
         for idx, chunk in enumerate(chunks):
-            print(f"   [GEMMA CLEAN] Chunk {idx+1}/{len(chunks)}")
-
-            payload = {
-                "model": MODEL_NAME,
-                "messages": [
-                    {"role": "system", "content": CLEANING_PROMPT},
-                    {"role": "user", "content": chunk}
-                ],
-                "temperature": 0.0,
-                "max_tokens": 4096
-            }
-
-            r = requests.post(
-                API_URL,
-                json=payload,
-                headers={"Authorization": f"Bearer {API_KEY}"},
-                timeout=200
-            )
-
-            if r.status_code != 200:
-                print("      ⚠️ Gemma chunk failed — fallback")
-                outputs.append(strip_html_basic(chunk))
+            if outputs[idx] is not None:
+                print(f"   [GEMMA CLEAN] Chunk {idx+1}/{len(chunks)} (cached)")
                 continue
-
-            content = (
-                r.json()
-                  .get("choices", [{}])[0]
-                  .get("message", {})
-                  .get("content", "")
-                  .strip()
-            )
-
-            if not content:
-                print("      ⚠️ Gemma returned empty — fallback")
-                outputs.append(strip_html_basic(chunk))
-            else:
-                outputs.append(content)
-
-            time.sleep(0.15)
+            print(f"   [GEMMA CLEAN] Chunk {idx+1}/{len(chunks)}")
+            futures[idx] = LLM.submit(chunk_payload(chunk), timeout=200)
+        try:
+            for idx, future in futures.items():
+                outputs[idx] = chunk_result(future.result(), chunks[idx])
+        finally:
+            for future in futures.values():
+                future.cancel()  # only drops chunks still waiting in the queue
 
         result = "\n".join(outputs)
         
@@ -289,71 +887,258 @@ def gpt_clean(html: str) -> str:
 
     except Exception as e:
         print("⚠️ Gemma cleaning FAILED:", e)
-        return strip_html_basic(html)
+        return page.text
+
+def _outermost(nodes):
+    """The nodes not inside another of the given nodes (order kept)."""
+    ids = {node.mem_id for node in nodes}
+    roots = []
+    for node in nodes:
+        parent = node.parent
+        while parent is not None and parent.mem_id not in ids:
+            parent = parent.parent
+        if parent is None:
+            roots.append(node)
+    return roots
 
-def extract_article_content(html: str) -> str:
+
+def remove_junk(tree):
+    """Remove every JUNK_SELECTORS match from the tree in place."""
+    for selector in JUNK_SELECTORS:
+        for elem in tree.css(selector):
+            elem.decompose()
+
+
+def extract_article_content(html) -> str:
     """
     Aggressively extract ONLY the article content area from full HTML.
     Removes head, scripts, nav, footer, ads, etc. BEFORE text extraction.
+    Accepts raw HTML or a ParsedPage (whose result is cached).
     """
-    try:
-        tree = HTMLParser(html)
-        
-        # STEP 1: Remove junk using configurable selector list
-        for selector in JUNK_SELECTORS:
-            for elem in tree.css(selector):
-                elem.decompose()
-        
-        # STEP 2: Try to find main article content
-        article = None
-        
-        # Try various article content selectors (in order of preference)
-        selectors = [
-            "article",
-            "[class*='article-content']",
-            "[class*='post-content']",
-            "[class*='entry-content']",
-            "[class*='story-content']",
-            "[id*='article-content']",
-            "[id*='post-content']",
-            ".article-body",
-            ".post-body",
-            "main",
-            "[role='main']",
-            "#main-content",
-            ".content"
-        ]
-        
-        for selector in selectors:
-            article = tree.css_first(selector)
-            if article:
-                print(f"   [FOUND] Article container: {selector}")
+    return as_parsed_page(html).article_html
+
+
+# Article container selectors, in order of preference
+ARTICLE_SELECTORS = [
+    "article",
+    "[class*='article-content']",
+    "[class*='post-content']",
+    "[class*='entry-content']",
+    "[class*='story-content']",
+    "[id*='article-content']",
+    "[id*='post-content']",
+    ".article-body",
+    ".post-body",
+    "main",
+    "[role='main']",
+    "#main-content",
+    ".content"
+]
+
+
+def _find_article_node(tree, domain=None):
+    """
+    Remove junk from the tree (in place) and return the article container node,
+    falling back to <body>. Returns None if there is neither.
+    With a domain, the site's learned template is tried first (see TemplateCache).
+    """
+    if domain:
+        article = TEMPLATES.find_article(tree, domain)
+    else:
+        _, article = _search_article_node(tree)
+    
+    # No selector matched - pick the densest text block
+    if not article:
+        article = _density_article_node(tree)
+        if article:
+            print(f"   [DENSITY] Article container: {_describe_node(article)}")
+    
+    # If no article found, use body
+    if not article:
+        article = tree.css_first("body")
+        if article:
+            print(f"   [FALLBACK] Using <body> as article container")
+    
+    if not article:
+        print(f"   [ERROR] No article container found at all!")
+    return article
+
+
+def _search_article_node(tree):
+    """Full junk removal, then every ARTICLE_SELECTORS entry in order. Returns (selector, node)."""
+    # STEP 1: Remove junk using configurable selector list
+    remove_junk(tree)
+    return _select_article_node(tree)
+
+
+def _select_article_node(tree):
+    """The first ARTICLE_SELECTORS match in a tree with junk removed. Returns (selector, node)."""
+    # STEP 2: Try various article content selectors (in order of preference)
+    for selector in ARTICLE_SELECTORS:
+        article = tree.css_first(selector)
+        if article:
+            print(f"   [FOUND] Article container: {selector}")
+            return selector, article
+    return None, None
+
+
+# Text blocks scored by _density_article_node, and the shortest that counts
+DENSITY_BLOCKS = "p, pre, blockquote"
+DENSITY_MIN_TEXT = 25
+# Candidates whose link density is checked (best raw scores first)
+DENSITY_TOP_CANDIDATES = 5
+
+
+def _density_article_node(tree):
+    """
+    Readability-style pick of the main content block. One pass over the text
+    blocks: each scores its parent fully and its grandparent by half, by
+    length and commas - so nodes holding many real paragraphs win. The best
+    candidates are then discounted by their link density.
+    Returns None when the page has no real paragraphs.
+    """
+    candidates = {}  # mem_id -> [node, score]
+    for block in tree.css(DENSITY_BLOCKS):
+        text = block.text(strip=True)
+        if len(text) < DENSITY_MIN_TEXT:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+
+        node = block.parent
+        for weight in (1, 0.5):
+            if node is None or node.tag == "html":
                 break
-        
-        # STEP 3: If no article found, use body
-        if not article:
-            article = tree.css_first("body")
+            entry = candidates.setdefault(node.mem_id, [node, 0.0])
+            entry[1] += score * weight
+            node = node.parent
+
+    best, best_score = None, 0.0
+    for node, score in heapq.nlargest(DENSITY_TOP_CANDIDATES, candidates.values(), key=lambda entry: entry[1]):
+        text_length = len(node.text(strip=True)) or 1
+        link_length = sum(len(a.text(strip=True)) for a in node.css("a"))
+        score *= 1 - min(link_length / text_length, 1)
+        if score > best_score:
+            best, best_score = node, score
+    return best
+
+
+def _describe_node(node) -> str:
+    """Short tag#id.class label for log lines."""
+    label = node.tag
+    attrs = node.attributes
+    if attrs.get("id"):
+        label += f"#{attrs['id']}"
+    if attrs.get("class"):
+        label += "." + ".".join(attrs["class"].split())
+    return label
+
+
+class TemplateCache:
+    """
+    Per-domain extraction templates: the article container selector that wins
+    on a site, persisted as JSON.
+
+    Every page goes through the full junk pass - what a page carries can
+    differ from the pages a template was learned on. While learning, the
+    whole ARTICLE_SELECTORS cascade runs; once one selector has won
+    TEMPLATE_MIN_PAGES times, pages run that one query instead. The first
+    lookup of every TEMPLATE_WINDOW is a full search again: if another
+    selector wins it (a redesign can add a better container while the old
+    one still matches), the domain goes straight back to learning. A hit
+    rate below TEMPLATE_MIN_HIT_RATE does the same.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._templates = None  # loaded on first use
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._templates is None:
+            self._templates = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._templates = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"[TEMPLATE] Ignoring unreadable {self.path}: {e}")
+        return self._templates
+
+    def save(self):
+        """Write the templates to disk (atomically)."""
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps(self._load(), indent=1, sort_keys=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def get(self, domain):
+        with self._lock:
+            return self._load().get(domain)
+
+    def find_article(self, tree, domain):
+        """Remove junk and return the article container (or None), learning as it goes."""
+        remove_junk(tree)
+
+        with self._lock:
+            template = self._load().get(domain) or {}
+            selector = template.get("selector")
+            full_pass = not selector or template["lookups"] % TEMPLATE_WINDOW == 0
+
+        if not full_pass:
+            article = tree.css_first(selector)
             if article:
-                print(f"   [FALLBACK] Using <body> as article container")
-        
-        if not article:
-            print(f"   [ERROR] No article container found at all!")
-            return strip_html_basic(html)
-        
-        # Get HTML of just the article area
-        article_html = article.html
-        
-        # STEP 4: Final cleaning of article HTML
-        article_html = re.sub(r"<script[\s\S]*?</script>", "", article_html, flags=re.I)
-        article_html = re.sub(r"<style[\s\S]*?</style>", "", article_html, flags=re.I)
-        article_html = re.sub(r"<!--.*?-->", "", article_html, flags=re.S)
-        
-        print(f"   [ARTICLE HTML] Length: {len(article_html)} chars")
-        return article_html.strip()
-        
-    except Exception as e:
-        print(f"   [ERROR] extract_article_content failed: {e}")
-        return strip_html_basic(html)
+                print(f"   [TEMPLATE] Article container: {selector}")
+                self._record(domain, selector, hit=True)
+                return article
+
+        # Learning, a periodic full pass or a miss: the whole selector search
+        winner, article = _select_article_node(tree)
+        self._record(
+            domain, winner, hit=selector is not None and winner == selector,
+            checked=selector is not None and full_pass,
+        )
+        return article
+
+    def _record(self, domain, winner, hit, checked=False):
+        with self._lock:
+            template = self._load().setdefault(
+                domain, {"selector": None, "wins": {}, "lookups": 0, "hits": 0}
+            )
+
+            if template["selector"] is None:
+                if winner:
+                    wins = template["wins"]
+                    wins[winner] = wins.get(winner, 0) + 1
+                    if wins[winner] >= TEMPLATE_MIN_PAGES:
+                        print(f"   [TEMPLATE] Learned {domain}: {winner}")
+                        template.update(selector=winner, lookups=0, hits=0)
+                return
+
+            if checked and not hit:
+                print(f"   [TEMPLATE] {winner or 'No container'} beat {template['selector']} on {domain} - learning again")
+                template.update(selector=None, wins={winner: 1} if winner else {}, lookups=0, hits=0)
+                return
+
+            template["lookups"] += 1
+            template["hits"] += hit
+            if template["lookups"] >= TEMPLATE_WINDOW:
+                rate = template["hits"] / template["lookups"]
+                if rate < TEMPLATE_MIN_HIT_RATE:
+                    print(f"   [TEMPLATE] Hit rate {rate:.0%} on {domain} - learning again")
+                    template.update(selector=None, wins={})
+                template.update(lookups=0, hits=0)
+
+
+TEMPLATES = TemplateCache(TEMPLATE_CACHE_PATH)
+
+
+def _clean_article_html(article_html: str) -> str:
+    """Final cleaning of the article container HTML."""
+    return CODE_STRIPPER.strip(article_html).strip()
 
 
 def gpt_summary(text: str) -> str:
@@ -364,7 +1149,11 @@ def gpt_summary(text: str) -> str:
     try:
         # Limit input to first 4000 chars for summary
         text_sample = text[:4000]
-        
+
+        cached = LLM_CACHE.get(MODEL_NAME, SUMMARY_PROMPT, text_sample)
+        if cached is not None:
+            return cached
+
         payload = {
             "model": MODEL_NAME,
             "messages": [
@@ -375,12 +1164,7 @@ def gpt_summary(text: str) -> str:
             "max_tokens": 512
         }
 
-        r = requests.post(
-            API_URL,
-            json=payload,
-            headers={"Authorization": f"Bearer {API_KEY}"},
-            timeout=200
-        )
+        r = LLM.post(payload, timeout=200)
 
         if r.status_code != 200:
             print("      ⚠️ Summary failed - no Gemma")
@@ -394,6 +1178,8 @@ def gpt_summary(text: str) -> str:
               .strip()
         )
 
+        if result:
+            LLM_CACHE.put(MODEL_NAME, SUMMARY_PROMPT, text_sample, result)
         return result or ""
 
     except Exception as e:
@@ -401,136 +1187,392 @@ def gpt_summary(text: str) -> str:
         return ""
 
 
-def manual_clean(html: str) -> str:
+def manual_clean(html) -> str:
     """
     Manual HTML cleaning using selectolax - NO LLM.
     More reliable but less sophisticated than LLM cleaning.
     Extracts ONLY text from article elements.
+    Accepts raw HTML or a ParsedPage.
     """
+    page = as_parsed_page(html)
     try:
         print(f"   [MANUAL CLEAN] Starting...")
         
-        # STEP 1: Extract article content area first
-        article_html = extract_article_content(html)
-        
-        # STEP 2: Parse with selectolax
-        tree = HTMLParser(article_html)
-        
-        # STEP 3: Remove all unwanted elements (already done in extract_article_content via JUNK_SELECTORS)
-        
-        # STEP 4: Extract text from article elements only
-        parts = []
-        
-        # Get title/h1
-        h1 = tree.css_first("h1")
-        if h1:
-            title = h1.text(strip=True)
-            if title:
-                parts.append(title)
-                parts.append("")  # blank line after title
-        
-        # Get article content
-        for selector in ["p", "h2", "h3", "h4", "li", "blockquote"]:
-            for elem in tree.css(selector):
-                text = elem.text(strip=True)
-                
-                # Filter out junk text
-                if len(text) < 3:
-                    continue
-                
-                # Skip if looks like navigation/footer/ads
-                lower = text.lower()
-                skip_patterns = [
-                    "click to share", "share on", "tweet", "share this",
-                    "subscribe", "newsletter", "follow us", "sign up",
-                    "read more", "continue reading", "related:", "tags:",
-                    "posted in", "filed under", "advertisement", "sponsored",
-                    "comment", "leave a comment", "view all posts",
-                    "copyright", "all rights reserved",
-                    "privacy policy", "terms of use", "cookie policy"
-                ]
-                
-                if any(pattern in lower for pattern in skip_patterns):
-                    continue
-                
-                # Skip if it's just a link with no substance
-                if text.startswith("http") or text.startswith("www"):
-                    continue
-                
-                parts.append(text)
-        
-        result = "\n\n".join(parts)
-        
-        # STEP 5: Final cleanup
-        result = re.sub(r"\s+", " ", result)  # normalize spaces
-        result = re.sub(r"\n\s*\n\s*\n+", "\n\n", result)  # max 2 newlines
+        # STEP 1: Article container from the already parsed page
+        # (junk removed via JUNK_SELECTORS) - no re-parse needed
+        result = _article_text(page.article)
         
         print(f"   [MANUAL CLEAN] Output: {len(result)} chars")
-        return result.strip()
+        return result
         
     except Exception as e:
         print(f"⚠️ Manual cleaning FAILED: {e}")
-        return strip_html_basic(html)
+        return page.text
 
 
-def strip_html_basic(html: str) -> str:
-    """Fallback text extraction when main cleaning fails."""
+def density_clean(html) -> str:
+    """
+    Text-density cleaning - NO LLM and no container selectors.
+    Takes the block with the most paragraph text and the fewest links
+    (see _density_article_node) instead of the selector cascade.
+    Accepts raw HTML or a ParsedPage.
+    """
+    page = as_parsed_page(html)
     try:
-        # First remove all scripts, styles, head, images
-        html = re.sub(r"<head[\s\S]*?</head>", "", html, flags=re.I)
-        html = re.sub(r"<script[\s\S]*?</script>", "", html, flags=re.I)
-        html = re.sub(r"<style[\s\S]*?</style>", "", html, flags=re.I)
-        html = re.sub(r"<img[\s\S]*?>", "", html, flags=re.I)
-        html = re.sub(r"<!--.*?-->", "", html, flags=re.S)
+        print(f"   [DENSITY CLEAN] Starting...")
         
-        tree = HTMLParser(html)
-        parts = []
-        for node in tree.css("p, li, h1, h2, h3, h4"):
-            t = node.text(strip=True)
-            if len(t) > 10:  # Longer threshold to skip junk
-                parts.append(t)
-        return "\n\n".join(parts)
-    except:
-        return ""
+        result = _article_text(page.content_node)
+        
+        print(f"   [DENSITY CLEAN] Output: {len(result)} chars")
+        return result
+        
+    except Exception as e:
+        print(f"⚠️ Density cleaning FAILED: {e}")
+        return page.text
+
+
+# Text blocks _article_text keeps, and the text that marks a block as chrome
+ARTICLE_TEXT_BLOCKS = "p, h2, h3, h4, li, blockquote"
+ARTICLE_TEXT_TAGS = frozenset(tag.strip() for tag in ARTICLE_TEXT_BLOCKS.split(","))
+SKIP_TEXT_PATTERNS = [
+    "click to share", "share on", "tweet", "share this",
+    "subscribe", "newsletter", "follow us", "sign up",
+    "read more", "continue reading", "related:", "tags:",
+    "posted in", "filed under", "advertisement", "sponsored",
+    "comment", "leave a comment", "view all posts",
+    "copyright", "all rights reserved",
+    "privacy policy", "terms of use", "cookie policy"
+]
 
 
-# ------------------------------
-# Metadata Extractor
-# ------------------------------
+def _literal_regex(words) -> str:
+    """
+    Regex matching any of the literal words, factored into a prefix trie so
+    the engine checks each position against one branch, not every word.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # end of a word
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A word ends here too - the longer continuations are optional
+        return f"(?:{body})?" if "" in node else body
 
-def extract_metadata(html: str):
-    tree = HTMLParser(html)
+    return build(trie)
 
-    # TITLE
-    title = ""
-    og = tree.css_first("meta[property='og:title']")
-    if og:
-        title = og.attributes.get("content", "")
 
-    if not title:
-        h1 = tree.css_first("h1")
-        if h1:
-            title = h1.text(strip=True)
+SKIP_TEXT = re.compile(_literal_regex(SKIP_TEXT_PATTERNS))
 
-    if not title:
-        title = "Untitled"
 
-    # AUTHOR
-    author = ""
+def _subtree(node):
+    """
+    node and the elements under it, in document order. Modest's traverse()
+    carries on into the node's following siblings, so stop where they start.
+    """
+    end = node.next
+    while end is not None and end.tag == "-text":
+        end = end.next
+    stop = end.mem_id if end is not None else None
+    for elem in node.traverse():
+        if elem.mem_id == stop:
+            return
+        yield elem
 
-    # Look for JSON-LD author
-    for n in tree.css("script[type='application/ld+json']"):
-        try:
-            data = json.loads(n.text(strip=True))
-            if isinstance(data, dict) and "author" in data:
-                if isinstance(data["author"], list):
-                    author = ", ".join(
-                        a.get("name", "") for a in data["author"] if "name" in a
-                    )
+
+def _block_texts(block, holders, done):
+    """
+    Texts of a block that holds other blocks, in document order: its own text
+    between the nested blocks, then each nested block's. holders are the
+    mem_ids of elements with blocks inside; nested blocks are added to done.
+    """
+    texts, run = [], []
+
+    def walk(node):
+        child = node.child
+        while child is not None:
+            if child.tag in ARTICLE_TEXT_TAGS:
+                done.add(child.mem_id)
+                texts.append("".join(run))
+                run.clear()
+                if child.mem_id in holders:
+                    walk(child)
+                    texts.append("".join(run))
+                    run.clear()
                 else:
-                    author = data["author"].get("name", "")
-        except:
-            pass
+                    texts.append(child.text(strip=True))
+            elif child.mem_id in holders:
+                walk(child)  # a wrapper around blocks - its text stays in the run
+            else:
+                run.append(child.text(strip=True))
+            child = child.next
+
+    walk(block)
+    texts.append("".join(run))
+    return texts
+
+
+def _article_text(tree) -> str:
+    """
+    Text of the title, paragraphs, headings, list items and quotes under a
+    container node, in document order. A block holding other blocks (an <li>
+    with a sub-list, a <blockquote> around <p>s) gives its own text and the
+    nested blocks' as separate pieces, so nothing comes out twice or is lost.
+    """
+    # STEP 2: Extract text from article elements only
+    parts = []
+    if tree is None:
+        return ""
+    
+    # Get title/h1
+    h1 = tree.css_first("h1")
+    if h1:
+        title = h1.text(strip=True)
+        if title:
+            parts.append(title)
+            parts.append("")  # blank line after title
+    
+    # Get article content
+    blocks = [elem for elem in _subtree(tree) if elem.tag in ARTICLE_TEXT_TAGS]
+    holders = set()
+    root = tree.mem_id
+    for elem in blocks:
+        if elem.mem_id == root:
+            continue
+        parent = elem.parent
+        while parent is not None and parent.mem_id not in holders:
+            holders.add(parent.mem_id)
+            if parent.mem_id == root:
+                break
+            parent = parent.parent
+    
+    done = set()
+    for elem in blocks:
+        if elem.mem_id in done:
+            continue
+        if elem.mem_id in holders:
+            texts = _block_texts(elem, holders, done)
+        else:
+            texts = (elem.text(strip=True),)
+        
+        for text in texts:
+            # Filter out junk text
+            if len(text) < 3:
+                continue
+            
+            # Skip if looks like navigation/footer/ads
+            if SKIP_TEXT.search(text.lower()):
+                continue
+            
+            # Skip if it's just a link with no substance
+            if text.startswith(("http", "www")):
+                continue
+            
+            parts.append(text)
+    
+    # STEP 3: Final cleanup - normalize all whitespace (newlines included) to single spaces
+    return " ".join(" ".join(parts).split())
+
+
+CLEANERS = {
+    "llm": gpt_clean,
+    "manual": manual_clean,
+    "density": density_clean,
+}
+
+
+def clean_quality(node, text: str):
+    """
+    How much to trust manual_clean output: (score 0-1, reasons it lost points).
+    `node` is the article container it was taken from.
+    """
+    if node is None or not text:
+        return 0.0, ["no article text"]
+
+    reasons = []
+    score = 1.0
+    paragraphs = [p.text(strip=True) for p in node.css("p")]
+    real = sum(len(t) >= DENSITY_MIN_TEXT for t in paragraphs)
+    if real < CLEAN_MIN_PARAGRAPHS:
+        score *= real / CLEAN_MIN_PARAGRAPHS
+        reasons.append(f"{real} paragraphs")
+    if len(text) < CLEAN_MIN_CHARS:
+        score *= len(text) / CLEAN_MIN_CHARS
+        reasons.append(f"{len(text)} chars")
+
+    total = len(node.text(strip=True)) or 1
+    link_density = min(sum(len(a.text(strip=True)) for a in node.css("a")) / total, 1.0)
+    if link_density > 0.2:
+        score *= 1 - link_density
+        reasons.append(f"links {link_density:.0%}")
+
+    junk = sum(1 for t in paragraphs if SKIP_TEXT.search(t.lower()))
+    if junk:
+        score *= 1 - junk / (len(paragraphs) + 1)
+        reasons.append(f"{junk} chrome paragraphs")
+
+    if node.tag in ("body", "html"):
+        score *= 0.5
+        reasons.append("no article container")
+    return score, reasons
+
+
+class CleaningRouter:
+    """
+    CLEANING_MODE "auto": manual_clean first, gpt_clean only when the manual
+    result scores below CLEAN_MIN_QUALITY. One per site - counts its routing
+    decisions and the LLM calls and tokens the manual pages saved.
+    """
+
+    def __init__(self, site: str = ""):
+        self.site = site
+        self.manual = 0
+        self.llm = 0
+        self.saved_calls = 0
+        self.saved_tokens = 0
+
+    def __call__(self, html) -> str:
+        page = as_parsed_page(html)
+        text = manual_clean(page)
+        score, reasons = clean_quality(page.article, text)
+
+        if score >= CLEAN_MIN_QUALITY:
+            print(f"   [ROUTE] manual (quality {score:.2f})")
+            self.manual += 1
+            # What gpt_clean would have sent
+            clean_input = html_preclean(page.article_html)
+            self.saved_calls += len(chunk_text(clean_input))
+            self.saved_tokens += count_tokens(clean_input)
+            return text
+
+        print(f"   [ROUTE] llm (quality {score:.2f}: {', '.join(reasons)})")
+        self.llm += 1
+        return gpt_clean(page)
+
+    def report(self):
+        if self.manual or self.llm:
+            print(f"   [ROUTE] {self.site}: {self.manual} manual, {self.llm} sent to the LLM - "
+                  f"saved {self.saved_calls} LLM calls (~{self.saved_tokens:,} tokens)")
+
+
+def strip_html_basic(html: str) -> str:
+    """Fallback text extraction when main cleaning fails."""
+    try:
+        # First remove all scripts, styles, head, images
+        html = PAGE_STRIPPER.strip(html)
+        
+        return _basic_text(HTMLParser(html))
+    except:
+        return ""
+
+
+# Elements whose content is never page text: code, and fallbacks for
+# browsers without JavaScript (tracking pixels, "please enable JS")
+PAGE_TEXT_SKIP = ["noscript", "script", "style"]
+
+
+def _basic_text(tree) -> str:
+    """
+    Text of paragraphs, list items and headings in a parsed tree.
+    Removes PAGE_TEXT_SKIP elements from the tree first (in place).
+    """
+    for selector in PAGE_TEXT_SKIP:
+        for node in tree.css(selector):
+            parent = node.parent
+            node.decompose()
+            # Rejoin the text around it, as if it had been stripped before parsing
+            if parent is not None:
+                parent.merge_text_nodes()
+
+    parts = []
+    for node in tree.css("p, li, h1, h2, h3, h4"):
+        t = node.text(strip=True)
+        if len(t) > 10:  # Longer threshold to skip junk
+            parts.append(t)
+    return "\n\n".join(parts)
+
+
+# ------------------------------
+# Metadata Extractor
+# ------------------------------
+
+def extract_metadata(html, default_published=None):
+    """
+    Title, author and published date of a page (raw HTML or ParsedPage).
+    Falls back to default_published, then to now, when there is no date.
+    """
+    return as_parsed_page(html).metadata(default_published)
+
+
+_HEAD_END = re.compile(r"</head\s*>", re.I)
+_HEAD_END_BYTES = re.compile(rb"</head\s*>", re.I)
+
+
+def _head_end(html):
+    """
+    Offset just past </head> when all <meta> tags and JSON-LD of the page sit
+    before it (the usual case), else None. Works on text or raw bytes.
+    """
+    if isinstance(html, bytes):
+        match = _HEAD_END_BYTES.search(html)
+        markers = (b"<meta", b"ld+json")
+    else:
+        match = _HEAD_END.search(html)
+        markers = ("<meta", "ld+json")
+    if match is None:
+        return None
+    # Plain substring checks - far cheaper than a case-insensitive regex over the body
+    body = html[match.end():].lower()
+    if any(marker in body for marker in markers):
+        return None
+    return match.end()
+
+
+def _metadata_from_tree(tree, full_tree=None):
+    """
+    (title, author, published or None) from an untouched parsed page.
+    tree may cover just the <head> (see _head_end); the h1/byline fallbacks
+    then use full_tree(), which is only called when they are needed.
+    """
+    if full_tree is None:
+        full_tree = lambda: tree
+
+    # TITLE
+    title = ""
+    og = tree.css_first("meta[property='og:title']")
+    if og:
+        title = og.attributes.get("content", "")
+
+    if not title:
+        h1 = full_tree().css_first("h1")
+        if h1:
+            title = h1.text(strip=True)
+
+    if not title:
+        title = "Untitled"
+
+    # AUTHOR
+    author = ""
+
+    # Look for JSON-LD author
+    for n in tree.css("script[type='application/ld+json']"):
+        try:
+            data = json.loads(n.text(strip=True))
+            if isinstance(data, dict) and "author" in data:
+                if isinstance(data["author"], list):
+                    author = ", ".join(
+                        a.get("name", "") for a in data["author"] if "name" in a
+                    )
+                else:
+                    author = data["author"].get("name", "")
+        except:
+            pass
 
     if not author:
         meta_author = tree.css_first("meta[name='author']")
@@ -538,7 +1580,7 @@ def extract_metadata(html: str):
             author = meta_author.attributes.get("content", "")
 
     if not author:
-        by = tree.css_first(".byline, .author, .post-author")
+        by = full_tree().css_first(".byline, .author, .post-author")
         if by:
             author = by.text(strip=True).replace("By ", "")
 
@@ -555,15 +1597,181 @@ def extract_metadata(html: str):
         except:
             pass
 
-    # If missing → use today
-    return title, author, datetime.utcnow()
+    return title, author, None
+
+
+# ------------------------------
+# URL Canonicalization
+# ------------------------------
+
+class URLCanonicalizer:
+    """
+    Reduces URLs to one canonical form using DEFAULT_CANONICAL_RULES
+    plus any overrides. Use for_site() to pick up per-site rules.
+    """
+
+    DEFAULT_PORTS = {"http": 80, "https": 443}
+
+    def __init__(self, **overrides):
+        rules = dict(DEFAULT_CANONICAL_RULES)
+        rules.update(overrides)
+
+        self.scheme = rules["scheme"]
+        self.strip_www = rules["strip_www"]
+        self.trailing_slash = rules["trailing_slash"]
+        self.sort_params = rules["sort_params"]
+        self.keep_fragment = rules["keep_fragment"]
+        self._strip_re = self._compile(rules["strip_params"])
+        self._keep_re = self._compile(rules["keep_params"])
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        return re.compile("|".join(f"(?:{p})" for p in patterns), re.I)
+
+    @classmethod
+    def for_site(cls, site_url: str, overrides=None):
+        """
+        Canonicalizer for one site: CANONICAL_URL_RULES[host], then
+        overrides, on top of DEFAULT_CANONICAL_RULES.
+        """
+        rules = dict(CANONICAL_URL_RULES.get(urlsplit(site_url).netloc.lower(), {}))
+        rules.update(overrides or {})
+        return cls(**rules)
+
+    def _keep_param(self, name: str) -> bool:
+        if self._keep_re is not None:
+            return bool(self._keep_re.fullmatch(name))
+        if self._strip_re is not None:
+            return not self._strip_re.fullmatch(name)
+        return True
+
+    def canonicalize(self, url: str) -> str:
+        parts = urlsplit(url.strip())
+        original_scheme = parts.scheme.lower()
+        scheme = original_scheme
+        if self.scheme and scheme in self.DEFAULT_PORTS:
+            scheme = self.scheme
+
+        # Host: lowercase, drop default port, optionally drop www.
+        netloc = parts.netloc.rsplit("@", 1)[-1].lower()
+        host, sep, port = netloc.rpartition(":")
+        if sep and port.isdigit():
+            if int(port) == self.DEFAULT_PORTS.get(original_scheme):
+                netloc = host
+        if self.strip_www and netloc.startswith("www."):
+            netloc = netloc[4:]
+
+        # Path: normalize the trailing slash (root always stays "/")
+        path = parts.path or "/"
+        if path != "/":
+            if self.trailing_slash == "strip":
+                path = path.rstrip("/") or "/"
+            elif self.trailing_slash == "add" and not path.endswith("/"):
+                if "." not in path.rsplit("/", 1)[-1]:
+                    path += "/"
+
+        # Query: drop tracking params, stable order. Params are kept byte for
+        # byte - re-encoding would rewrite escapes the server may depend on
+        query = parts.query
+        if query:
+            params = [
+                param for param in query.split("&")
+                if param and self._keep_param(unquote_plus(param.split("=", 1)[0]))
+            ]
+            if self.sort_params:
+                params.sort()
+            query = "&".join(params)
+
+        fragment = parts.fragment if self.keep_fragment else ""
+        return urlunsplit((scheme, netloc, path, query, fragment))
+
+    __call__ = canonicalize
 
 
 # ------------------------------
 # URL Discovery (universal)
 # ------------------------------
 
-def extract_article_links(html: str, base_url: str):
+class URLClassifier:
+    """
+    Single-pass URL classifier for discovery.
+    Compiled once from URL_EXCLUDE_PATTERNS, URL_SECTION_PATTERNS and the article
+    heuristics into one regex whose branches are tried in priority order, so
+    classify() answers exclude / section / article with a single match call.
+    """
+
+    EXCLUDE = "exclude"    # never crawl, never queue
+    SECTION = "section"    # crawl for links, never an article
+    ARTICLE = "article"    # crawl and collect as article
+    OTHER = "other"        # crawl for links only
+
+    # (group name, regex, guard, reason) - checked in this order, first match wins.
+    # The guard is an extra lookahead applied to the whole URL.
+    ARTICLE_RULES = [
+        # Pattern 1: Has /article/ in URL (common for news sites)
+        ("article_path", r"/article/", "", "/article/ in URL"),
+        # Pattern 2: /news/2024/01/26/title-slug or /story/2024/01/26/title-slug
+        ("news_date", r"/(?:news|story)/20\d{2}/\d{2}/\d{2}/[\w-]+", "",
+         "/news or /story with full date"),
+        # Pattern 3: /2024/01/26/title-slug/ or /2024/01/26/title-slug
+        ("full_date", r"/20\d{2}/\d{2}/\d{2}/[\w-]+", "", "Full date path"),
+        # Pattern 4: WordPress-style /year/month/slug (no day, no trailing slash)
+        ("wp_date", r"/20\d{2}/\d{2}/[\w-]{10,}", r"(?![\s\S]*/\Z)", "WordPress date style"),
+        # Pattern 5: Long unique slug at end (likely article, not category)
+        ("long_slug", r"/[\w-]{20,}/?$", "", "Long slug"),
+    ]
+
+    # Slugs that are sections even when they pass the long-slug rule
+    CATEGORY_WORDS = frozenset([
+        'news', 'politics', 'world', 'business', 'sports',
+        'tech', 'technology', 'science', 'opinion', 'entertainment',
+        'lifestyle', 'health', 'culture', 'economy', 'society'
+    ])
+
+    def __init__(self, exclude_patterns=None, section_patterns=None):
+        if exclude_patterns is None:
+            exclude_patterns = URL_EXCLUDE_PATTERNS
+        if section_patterns is None:
+            section_patterns = URL_SECTION_PATTERNS
+
+        branches = []
+        if exclude_patterns:
+            joined = "|".join(f"(?:{p})" for p in exclude_patterns)
+            branches.append(rf"(?=[\s\S]*?(?P<{self.EXCLUDE}>(?i:{joined})))")
+        if section_patterns:
+            joined = "|".join(f"(?:{p})" for p in section_patterns)
+            branches.append(rf"(?=[\s\S]*?(?P<{self.SECTION}>(?i:{joined})))")
+        for name, pattern, guard, _ in self.ARTICLE_RULES:
+            branches.append(rf"{guard}(?=[\s\S]*?(?P<{name}>{pattern}))")
+
+        self._regex = re.compile("^(?:" + "|".join(branches) + ")")
+        self._reasons = {name: reason for name, _, _, reason in self.ARTICLE_RULES}
+
+    def classify(self, url: str):
+        """Return (kind, reason) where kind is EXCLUDE, SECTION, ARTICLE or OTHER."""
+        m = self._regex.match(url)
+        if not m:
+            return self.OTHER, ""
+
+        group = m.lastgroup
+        if group == self.EXCLUDE or group == self.SECTION:
+            return group, ""
+
+        if group == "long_slug":
+            slug = url.rstrip('/').split('/')[-1]
+            if slug.lower() in self.CATEGORY_WORDS:
+                return self.OTHER, ""
+            return self.ARTICLE, f"{self._reasons[group]} ({len(slug)} chars)"
+
+        return self.ARTICLE, self._reasons[group]
+
+
+URL_CLASSIFIER = URLClassifier()
+
+
+def extract_article_links(html: str, base_url: str, canonicalizer=None):
     """
     Handles all broken discovery cases:
     - card links
@@ -571,30 +1779,326 @@ def extract_article_links(html: str, base_url: str):
     - Hindi/Marathi unicode URLs
     - '/politics/<slug>'
     - Medium redirects
+    Links are returned as found (absolute, without fragment), one per
+    canonical form (see URLCanonicalizer). html may also be a ParsedPage.
     """
-    tree = HTMLParser(html)
-    links = set()
+    tree = html.tree if isinstance(html, ParsedPage) else HTMLParser(html)
+    return _links_from_tree(tree, base_url, canonicalizer)
+
+
+def _links_from_tree(tree, base_url: str, canonicalizer=None):
+    if canonicalizer is None:
+        canonicalizer = URLCanonicalizer.for_site(base_url)
+
+    links = {}  # canonical key -> URL as found
+    base_netloc = urlparse(canonicalizer(base_url)).netloc
 
     for a in tree.css("a"):
         href = a.attributes.get("href")
         if not href:
             continue
 
-        # Resolve relative → absolute
-        url = urljoin(base_url, href)
+        # Resolve relative → absolute; the canonical form is only the dedup key
+        url = urldefrag(urljoin(base_url, href))[0]
+        key = canonicalizer(url)
 
         # Filter non-article patterns
-        if any(x in url.lower() for x in [
+        if any(x in key.lower() for x in [
             "login", "signup", "privacy", "terms",
             "contact", "about", ".jpg", ".png", ".gif"
         ]):
             continue
 
         # Accept only same-site links
-        if urlparse(url).netloc == urlparse(base_url).netloc:
-            links.add(url)
+        if urlparse(key).netloc == base_netloc:
+            links.setdefault(key, url)
 
-    return list(links)
+    return list(links.values())
+
+
+# ------------------------------
+# SITE BOILERPLATE
+# ------------------------------
+
+class BoilerplateModel:
+    """
+    Per-site boilerplate learned from repetition (see SITE BOILERPLATE config).
+    Each text block is reduced to a blake2b fingerprint of its normalized
+    text; the model only keeps how many pages each fingerprint was on.
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(text: str) -> bytes:
+        return hashlib.blake2b(" ".join(text.lower().split()).encode(), digest_size=8).digest()
+
+    def observe(self, tree):
+        """Count the blocks of one (untouched) page."""
+        prints = set()
+        for node in tree.css(ARTICLE_TEXT_BLOCKS):
+            text = node.text(strip=True)
+            if len(text) >= 3:
+                prints.add(self.fingerprint(text))
+        with self._lock:
+            self.pages += 1
+            for fp in prints:
+                self._counts[fp] = self._counts.get(fp, 0) + 1
+
+    def remove(self, node) -> int:
+        """
+        Remove the boilerplate blocks under node, in place.
+        Returns the number of characters removed.
+        """
+        with self._lock:
+            if self.pages < BOILERPLATE_MIN_PAGES:
+                return 0
+            threshold = max(2, BOILERPLATE_MIN_SHARE * self.pages)
+            counts = self._counts
+
+            blocks = []
+            for block in node.css(ARTICLE_TEXT_BLOCKS):
+                text = block.text(strip=True)
+                if counts.get(self.fingerprint(text), 0) >= threshold:
+                    blocks.append(block)
+
+        blocks = _outermost(blocks)
+        removed = sum(len(block.text(strip=True)) for block in blocks)
+        # Mostly "boilerplate" means the article itself is repeated (e.g. on
+        # listing pages) - keep it
+        if not removed or removed > BOILERPLATE_MAX_REMOVED * len(node.text(strip=True)):
+            return 0
+        for block in blocks:
+            block.decompose()
+        return removed
+
+
+# ------------------------------
+# PARSED PAGE
+# ------------------------------
+
+# Bytes of the body searched for a <meta charset> declaration
+SNIFF_BYTES = 4096
+
+_META_CHARSET = re.compile(rb"""<meta[^>]*?charset\s*=\s*["']?\s*([\w.:-]+)""", re.I)
+_BOMS = ((codecs.BOM_UTF8, "utf-8"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+
+def _codec_name(label):
+    """Normalized codec name for a charset label, or None if Python does not know it."""
+    try:
+        name = codecs.lookup(label.decode("ascii") if isinstance(label, bytes) else label).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+    # Browsers read these labels as windows-1252
+    return "cp1252" if name in ("latin-1", "iso8859-1", "ascii") else name
+
+
+def sniff_encoding(body: bytes, content_type: str = ""):
+    """
+    Encoding declared for an HTML body: BOM, then an explicit charset in the
+    Content-Type header, then <meta charset> in the first SNIFF_BYTES bytes.
+    Returns None when nothing is declared.
+    """
+    for bom, name in _BOMS:
+        if body.startswith(bom):
+            return name
+
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            name = _codec_name(value.strip().strip("'\""))
+            if name:
+                return name
+
+    match = _META_CHARSET.search(body, 0, SNIFF_BYTES)
+    if match:
+        name = _codec_name(match.group(1))
+        # A page can't be UTF-16 if its ASCII <meta> tag was readable
+        return "utf-8" if name and name.startswith("utf-16") else name
+    return None
+
+
+def decode_html(body: bytes, encoding=None):
+    """
+    (text, encoding) for an HTML body. Without a known encoding UTF-8 is tried
+    first; full charset detection over the body is the last resort.
+    """
+    if encoding:
+        try:
+            return body.decode("utf-8-sig" if encoding == "utf-8" else encoding, errors="replace"), encoding
+        except LookupError:
+            pass
+    try:
+        return body.decode("utf-8-sig"), "utf-8"
+    except UnicodeDecodeError:
+        pass
+    encoding = _codec_name(requests.compat.chardet.detect(body)["encoding"] or "") or "utf-8"
+    return body.decode(encoding, errors="replace"), encoding
+
+
+class ParsedPage:
+    """
+    One HTML page, parsed once. The views the article pipeline needs -
+    metadata, plain text, links and the article container - are computed
+    from the same tree on first use and cached.
+
+    html is the page text, or the raw body bytes together with the encoding
+    sniffed by fetch_html. UTF-8 bytes go to the parser as they are; text is
+    only decoded when something asks for page.html.
+    """
+
+    def __init__(self, html, url: str = "", canonicalizer=None, encoding=None, boilerplate=None):
+        if isinstance(html, bytes):
+            self.body, self._html = html, None
+        else:
+            self.body, self._html = None, html
+        self.encoding = encoding
+        self.boilerplate = boilerplate
+        self.url = url
+        self.canonicalizer = canonicalizer
+        self._tree = None
+        self._metadata = None
+        self._text = None
+        self._links = None
+        self._article = None
+        self._article_html = None
+        self._article_done = False
+        self._content_node = None
+        self._content_html = None
+        self._edited = False
+
+    @property
+    def html(self) -> str:
+        if self._html is None:
+            self._html, self.encoding = decode_html(self.body, self.encoding)
+        return self._html
+
+    def _parse(self):
+        if self.body is not None and self.encoding == "utf-8":
+            body = self.body[len(codecs.BOM_UTF8):] if self.body.startswith(codecs.BOM_UTF8) else self.body
+            return HTMLParser(body, detect_encoding=False, use_meta_tags=False)
+        return HTMLParser(self.html)
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = self._parse()
+        return self._tree
+
+    def metadata(self, default_published=None):
+        """(title, author, published); published falls back to default_published, then now."""
+        if self._metadata is None:
+            end = _head_end(self.body if self.body is not None else self._html)
+            if end is None:
+                scope = self.tree
+            elif self._tree is not None:
+                scope = self.tree.head or self.tree
+            else:
+                # Nothing parsed yet - the <meta>/JSON-LD lookups only need the head
+                head = self.body[:end] if self.body is not None else self._html[:end]
+                scope = ParsedPage(head, encoding=self.encoding).tree
+            self._metadata = _metadata_from_tree(scope, lambda: self.tree)
+        title, author, published = self._metadata
+        return title, author, published or default_published or datetime.utcnow()
+
+    @property
+    def text(self) -> str:
+        """Plain text of paragraphs, list items and headings (see strip_html_basic)."""
+        if self._text is None:
+            # Scripts are removed from the tree - read the JSON-LD metadata first
+            self.metadata()
+            self._text = _basic_text(self.tree)
+        return self._text
+
+    @property
+    def links(self):
+        """Canonical same-site links (see extract_article_links). Needs url."""
+        if self._links is None:
+            # Junk removal drops nav/sidebar links, so after it use a fresh tree
+            tree = self._parse() if self._edited else self.tree
+            self._links = _links_from_tree(tree, self.url, self.canonicalizer)
+        return self._links
+
+    def _edit_tree(self):
+        """
+        Junk removal edits the tree in place - capture the views that
+        need the untouched page first. Returns the tree.
+        """
+        if not self._edited:
+            self.metadata()
+            self.text
+            if self.boilerplate is not None:
+                self.boilerplate.observe(self.tree)
+            self._edited = True
+        return self.tree
+
+    def _remove_boilerplate(self, node):
+        if self.boilerplate is not None and node is not None:
+            removed = self.boilerplate.remove(node)
+            if removed:
+                print(f"   [BOILERPLATE] Removed {removed} chars of repeated site blocks")
+
+    @property
+    def article(self):
+        """Article container node with junk removed, or None."""
+        if not self._article_done:
+            self._article = _find_article_node(self._edit_tree(), urlparse(self.url).netloc)
+            self._remove_boilerplate(self._article)
+            self._article_done = True
+        return self._article
+
+    @property
+    def content_node(self):
+        """
+        Block with the best text density (see _density_article_node), junk
+        removed. Container selectors and site templates are not consulted.
+        """
+        if self._content_node is None:
+            tree = self._edit_tree()
+            remove_junk(tree)
+            node = _density_article_node(tree)
+            if node is None:
+                node = tree.css_first("body")
+                if node is not None:
+                    print(f"   [FALLBACK] Using <body> as content node")
+            self._remove_boilerplate(node)
+            self._content_node = node
+        return self._content_node
+
+    @property
+    def article_html(self) -> str:
+        """Cleaned HTML of the article container (plain text if there is none)."""
+        if self._article_html is None:
+            article = self.article
+            if article is None:
+                self._article_html = self.text
+            else:
+                self._article_html = _clean_article_html(article.html)
+                print(f"   [ARTICLE HTML] Length: {len(self._article_html)} chars")
+        return self._article_html
+
+    @property
+    def content_html(self) -> str:
+        """Cleaned HTML of content_node (plain text if there is none) - article_html for density mode."""
+        if self._content_html is None:
+            node = self.content_node
+            if node is None:
+                self._content_html = self.text
+            else:
+                self._content_html = _clean_article_html(node.html)
+                print(f"   [CONTENT HTML] Length: {len(self._content_html)} chars")
+        return self._content_html
+
+
+def as_parsed_page(html) -> ParsedPage:
+    """Wrap raw HTML in a ParsedPage; ParsedPage objects are passed through."""
+    if isinstance(html, ParsedPage):
+        return html
+    return ParsedPage(html)
 
 
 # ------------------------------
@@ -609,217 +2113,997 @@ def upsert_post(db, blog_id, url, title, text, html, author, tags, published, su
     return row[0] if row else None
 
 
+# ------------------------------
+# HTTP CLIENT
+# ------------------------------
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def _pool_adapter(maxsize: int) -> HTTPAdapter:
+    return HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=maxsize)
+
+
+def get_http_session() -> requests.Session:
+    """
+    Shared HTTP client for discovery, article fetches and LLM calls.
+    One requests session for the whole run: connections are kept alive and
+    reused per host, so TCP+TLS handshakes are paid once, not per request.
+    Pool sizes come from HTTP_POOL_MAXSIZE and HTTP_POOL_OVERRIDES.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                default = _pool_adapter(HTTP_POOL_MAXSIZE)
+                session.mount("http://", default)
+                session.mount("https://", default)
+
+                # Per-host pools (longest mount prefix wins)
+                overrides = dict(HTTP_POOL_OVERRIDES)
+                llm_host = urlparse(API_URL).netloc
+                if llm_host:
+                    overrides.setdefault(llm_host, LLM_POOL_MAXSIZE)
+                for host, maxsize in overrides.items():
+                    adapter = _pool_adapter(maxsize)
+                    session.mount(f"http://{host}/", adapter)
+                    session.mount(f"https://{host}/", adapter)
+
+                _http_session = session
+    return _http_session
+
+
+# body is the raw bytes, encoding what the response declares (None if nothing),
+# content_type the bare media type ("" if the server sent none)
+FetchedPage = namedtuple("FetchedPage", "url status body encoding content_type")
+
+
+class FetchRejected(Exception):
+    """A response dropped by fetch_html: unexpected type, or larger than the byte cap."""
+
+
+def fetch_html(
+    url: str,
+    headers: dict,
+    timeout: float,
+    max_bytes: int = None,
+    content_types=HTML_CONTENT_TYPES,
+) -> FetchedPage:
+    """
+    Streamed GET of an HTML page (or another of content_types), following redirects.
+    The body is only read for 200 responses, and at most max_bytes of it
+    (MAX_PAGE_BYTES by default). Raises FetchRejected for other types or oversized
+    responses - before the download when the headers already tell.
+    """
+    if max_bytes is None:
+        max_bytes = MAX_PAGE_BYTES
+
+    with get_http_session().get(url, timeout=timeout, headers=headers, stream=True, allow_redirects=True) as response:
+        if response.status_code != 200:
+            return FetchedPage(response.url, response.status_code, None, None, None)
+
+        header = response.headers.get("Content-Type", "")
+        content_type = header.split(";")[0].strip().lower()
+        if content_type and content_type not in content_types:
+            raise FetchRejected(f"unexpected type ({content_type})")
+
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > max_bytes:
+            raise FetchRejected(f"too large ({int(length):,} bytes)")
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise FetchRejected(f"too large (over {max_bytes:,} bytes)")
+            chunks.append(chunk)
+        body = b"".join(chunks)
+
+        # Left undecoded - see ParsedPage and decode_html
+        return FetchedPage(response.url, 200, body, sniff_encoding(body, header), content_type)
+
+
 # ------------------------------
 # MAIN ARTICLE CRAWLER
 # ------------------------------
 
-def crawl_article(url: str):
+def crawl_article(url: str, canonicalizer=None, boilerplate=None):
     """
     Crawl a single article using plain requests (no Playwright).
-    Returns a simple object with html and markdown fields.
+    Returns a simple object with url (canonical, after redirects), html, markdown
+    and page (the ParsedPage) fields. The URL is fetched as given - the
+    canonical form is only the post key.
     """
+    if canonicalizer is None:
+        canonicalizer = URLCanonicalizer.for_site(url)
+
     try:
-        # More complete headers to avoid being blocked
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Cache-Control': 'max-age=0',
-        }
-        
-        response = requests.get(url, timeout=15, headers=headers, allow_redirects=True)
+        fetched = fetch_html(url, ARTICLE_HEADERS, timeout=15)
         
-        if response.status_code != 200:
-            print(f"   ⚠️ HTTP {response.status_code}")
+        if fetched.status != 200:
+            print(f"   ⚠️ HTTP {fetched.status}")
             return None
         
-        html = response.text
+        final_url = canonicalizer(fetched.url or url)
+        
+        # Parse once - later pipeline steps reuse this page (links resolve
+        # against the URL actually served)
+        page = ParsedPage(fetched.body, fetched.url or url, canonicalizer, fetched.encoding, boilerplate)
+        html = page.html
         
         # Extract text using our basic method
-        markdown = strip_html_basic(html)
+        markdown = page.text
         
         # Return object that mimics AsyncWebCrawler result
         class CrawlResult:
-            def __init__(self, html, markdown):
+            def __init__(self, url, html, markdown, page):
+                self.url = url
                 self.html = html
                 self.markdown = markdown
+                self.page = page
                 self.success = True
         
-        return CrawlResult(html, markdown)
+        return CrawlResult(final_url, html, markdown, page)
         
     except Exception as e:
         print(f"   ⚠️ Crawl error: {e}")
         return None
 
 
+def fetch_discovery_page(url: str):
+    """Blocking fetch of a single discovery page. Returns a ParsedPage or None."""
+    fetched = fetch_html(url, DISCOVERY_HEADERS, timeout=10)
+
+    if fetched.status != 200:
+        return None
+
+    return ParsedPage(fetched.body, fetched.url, encoding=fetched.encoding)
+
+
+class CrawlFrontier:
+    """
+    FIFO crawl frontier that deduplicates on enqueue.
+    Each URL is queued at most once per crawl and pop() is O(1),
+    so frontier cost stays flat no matter how often a link is repeated.
+    With a key function (e.g. a URLCanonicalizer), URLs are deduplicated on
+    key(url) but queued as given.
+    """
+
+    def __init__(self, urls=(), key=None):
+        self._queue = deque()
+        self._seen = set()
+        self._url_bytes = 0
+        self._head = 0  # sequence number of the URL pop() returns next
+        self._key = key or (lambda url: url)
+        for url in urls:
+            self.push(url)
+
+    @classmethod
+    def restore(cls, queued, seen, key=None):
+        """Rebuild a frontier from checkpointed (seq, url) pairs and every URL seen so far."""
+        frontier = cls(key=key)
+        if queued:
+            frontier._head = queued[0][0]
+        frontier._queue.extend(url for _, url in queued)
+        frontier._seen = {frontier._key(url) for url in seen}
+        frontier._seen.update(frontier._key(url) for url in frontier._queue)
+        frontier._url_bytes = sum(sys.getsizeof(url) for url in frontier._seen)
+        return frontier
+
+    def push(self, url: str) -> bool:
+        """Queue a URL unless it (or its key) was ever queued before. Returns True if queued."""
+        key = self._key(url)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self._queue.append(url)
+        self._url_bytes += sys.getsizeof(key)
+        return True
+
+    def pop(self) -> str:
+        url = self._queue.popleft()
+        self._head += 1
+        return url
+
+    @property
+    def head(self) -> int:
+        """Sequence number of the next URL pop() returns."""
+        return self._head
+
+    @property
+    def tail(self) -> int:
+        """Sequence number the next pushed URL gets."""
+        return self._head + len(self._queue)
+
+    def queued_since(self, seq: int):
+        """(seq, url) pairs for still-queued URLs pushed at or after seq."""
+        start = max(seq, self._head)
+        newest = list(islice(reversed(self._queue), self.tail - start))
+        return list(zip(range(start, self.tail), reversed(newest)))
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __contains__(self, url):
+        return self._key(url) in self._seen
+
+    @property
+    def seen_count(self) -> int:
+        return len(self._seen)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the frontier (containers + URL strings)."""
+        return sys.getsizeof(self._queue) + sys.getsizeof(self._seen) + self._url_bytes
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "seen": len(self._seen),
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+class CrawlStateStore:
+    """
+    SQLite-backed discovery state per site: frontier (with sequence numbers),
+    processed pages and article URLs. Checkpoints are incremental, so their
+    cost depends on what changed since the last one, not on frontier size.
+    """
+
+    def __init__(self, path: str = CRAWL_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sites (
+                    site TEXT PRIMARY KEY, status TEXT NOT NULL, updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS frontier (
+                    site TEXT NOT NULL, seq INTEGER NOT NULL, url TEXT NOT NULL,
+                    PRIMARY KEY (site, seq)
+                );
+                CREATE TABLE IF NOT EXISTS visited (
+                    site TEXT NOT NULL, url TEXT NOT NULL, PRIMARY KEY (site, url)
+                );
+                CREATE TABLE IF NOT EXISTS articles (
+                    site TEXT NOT NULL, url TEXT NOT NULL, PRIMARY KEY (site, url)
+                );
+            """)
+
+    def load(self, site: str):
+        """Saved state for a site as a dict, or None if there is none."""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM sites WHERE site = ?", (site,)).fetchone()
+            if not row:
+                return None
+            queued = self._conn.execute(
+                "SELECT seq, url FROM frontier WHERE site = ? ORDER BY seq", (site,)
+            ).fetchall()
+            visited = {u for (u,) in self._conn.execute("SELECT url FROM visited WHERE site = ?", (site,))}
+            articles = {u for (u,) in self._conn.execute("SELECT url FROM articles WHERE site = ?", (site,))}
+        return {"status": row[0], "queued": queued, "visited": visited, "articles": articles}
+
+    def checkpoint(self, site: str, resume_seq: int, queued, visited, articles):
+        """
+        Record progress: drop frontier entries before resume_seq, add newly queued
+        (seq, url) pairs, newly processed pages and newly found articles.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sites (site, status, updated_at) VALUES (?, 'running', ?)",
+                (site, time.time()),
+            )
+            self._conn.execute("DELETE FROM frontier WHERE site = ? AND seq < ?", (site, resume_seq))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO frontier (site, seq, url) VALUES (?, ?, ?)",
+                [(site, seq, url) for seq, url in queued if seq >= resume_seq],
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO visited (site, url) VALUES (?, ?)", [(site, u) for u in visited]
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO articles (site, url) VALUES (?, ?)", [(site, u) for u in articles]
+            )
+
+    def finish_discovery(self, site: str, articles):
+        """Keep only the discovered articles, so a resumed run skips discovery entirely."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM frontier WHERE site = ?", (site,))
+            self._conn.execute("DELETE FROM visited WHERE site = ?", (site,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO articles (site, url) VALUES (?, ?)", [(site, u) for u in articles]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sites (site, status, updated_at) VALUES (?, 'discovered', ?)",
+                (site, time.time()),
+            )
+
+    def clear(self, site: str):
+        with self._lock, self._conn:
+            for table in ("sites", "frontier", "visited", "articles"):
+                self._conn.execute(f"DELETE FROM {table} WHERE site = ?", (site,))
+
+
+def process_discovery_page(html, url, domain, frontier, article_urls, max_articles, canonicalizer,
+                           boilerplate=None):
+    """
+    Extract links from one fetched page, queue them for further discovery
+    and collect the ones that look like articles into article_urls
+    (canonical key -> URL as found).
+    The page also feeds the site's BoilerplateModel, if there is one.
+    """
+    if boilerplate is not None:
+        boilerplate.observe(as_parsed_page(html).tree)
+
+    links = extract_article_links(html, url, canonicalizer)
+
+    for link in links:
+        key = canonicalizer(link)
+
+        # Only stay on the same domain
+        if urlparse(key).netloc != domain:
+            continue
+
+        # SMART ARTICLE DETECTION - one precompiled pass:
+        # exclude (never queue) / section (queue, not an article) / article
+        kind, reason = URL_CLASSIFIER.classify(key)
+
+        if kind == URLClassifier.EXCLUDE:
+            continue
+
+        # Add to queue for further discovery (even if it's a section page)
+        frontier.push(link)
+
+        if kind == URLClassifier.ARTICLE:
+            print(f"   ✓ Article pattern: {reason}")
+
+            # Add to article list if it passes filters (canonical key -> URL)
+            if key not in article_urls:
+                article_urls[key] = link
+                print(f"   📰 ARTICLE ADDED: {link}")
+
+                if len(article_urls) >= max_articles:
+                    print(f"[DISCOVERY] ✅ HARD STOP: reached {max_articles} article URLs")
+                    break
+
+
+async def discover_all_links_async(
+    start_url: str,
+    max_pages: int = 500,
+    max_articles: int = 10,
+    max_concurrency: int = DISCOVERY_MAX_CONCURRENCY,
+    per_host_concurrency: int = DISCOVERY_PER_HOST_CONCURRENCY,
+    canonicalizer=None,
+    state=None,
+    resume: bool = False,
+    boilerplate=None,
+):
+    """
+    Concurrent BFS crawler to explore the entire domain, collecting every article link.
+    Up to max_concurrency pages (per_host_concurrency per host) are fetched ahead
+    in a sliding window, but results are processed strictly in BFS order -
+    so the article set is the same as a one-page-at-a-time crawl.
+    All URLs are deduplicated on their canonical form and fetched as found.
+    With a CrawlStateStore, progress is checkpointed every CHECKPOINT_EVERY pages
+    and resume=True continues from the last checkpoint.
+    """
+    if canonicalizer is None:
+        canonicalizer = URLCanonicalizer.for_site(start_url)
+    site_key = canonicalizer(start_url)
+
+    visited = set()
+    frontier = CrawlFrontier([start_url], key=canonicalizer)
+    article_urls = {}  # canonical key -> URL as found
+
+    saved = None
+    if state is not None:
+        saved = state.load(site_key) if resume else None
+        if saved is None:
+            state.clear(site_key)
+        elif saved["status"] == "discovered":
+            print(f"[RESUME] Discovery already finished: {len(saved['articles'])} articles")
+            return list(saved["articles"])[:max_articles]
+        else:
+            visited = saved["visited"]
+            frontier = CrawlFrontier.restore(saved["queued"], visited, key=canonicalizer)
+            article_urls = {canonicalizer(url): url for url in saved["articles"]}
+            print(f"[RESUME] {len(visited)} pages visited, {len(frontier)} queued, "
+                  f"{len(article_urls)} articles")
+
+    domain = urlparse(site_key).netloc
+
+    global_slots = asyncio.Semaphore(max_concurrency)
+    host_slots = {}
+
+    async def fetch(url):
+        host = urlparse(url).netloc
+        if host not in host_slots:
+            host_slots[host] = asyncio.Semaphore(per_host_concurrency)
+
+        async with host_slots[host]:
+            # Be nice to servers - waits for this host only, not the whole process
+            await POLITENESS.wait(url)
+
+            async with global_slots:
+                print(f"[DISCOVERY] Visiting: {url}")
+                try:
+                    return await asyncio.to_thread(fetch_discovery_page, url)
+                except Exception as e:
+                    print(f"[DISCOVERY] Error: {e}")
+                    return None
+
+    in_flight = deque()  # (seq, url, task) in BFS order
+
+    # Checkpoint bookkeeping: what changed since the last save
+    saved_tail = frontier.tail if saved else frontier.head
+    processed = []
+    saved_articles = set(article_urls)
+
+    def checkpoint():
+        nonlocal saved_tail
+        # Fetched-but-unprocessed pages are saved as still queued
+        resume_seq = in_flight[0][0] if in_flight else frontier.head
+        queued = [(seq, url) for seq, url, _ in in_flight if seq >= saved_tail]
+        queued += frontier.queued_since(saved_tail)
+        new_articles = [url for key, url in article_urls.items() if key not in saved_articles]
+        state.checkpoint(site_key, resume_seq, queued, processed, new_articles)
+        saved_tail = frontier.tail
+        processed.clear()
+        saved_articles.update(article_urls)
+
+    try:
+        while True:
+            # Keep the window full, popping the frontier in BFS order
+            while frontier and len(in_flight) < max_concurrency and len(visited) < max_pages:
+                seq = frontier.head
+                url = frontier.pop()
+                visited.add(url)
+                in_flight.append((seq, url, asyncio.create_task(fetch(url))))
+
+            if not in_flight:
+                break
+
+            _, url, task = in_flight.popleft()
+            html = await task
+            processed.append(url)
+
+            if html is not None:
+                try:
+                    process_discovery_page(
+                        html, url, domain, frontier, article_urls, max_articles, canonicalizer, boilerplate
+                    )
+                except Exception as e:
+                    print(f"[DISCOVERY] Error: {e}")
+
+            if len(article_urls) >= max_articles:
+                break
+
+            if state is not None and len(processed) >= CHECKPOINT_EVERY:
+                checkpoint()
+    finally:
+        for _, _, task in in_flight:
+            task.cancel()
+
+    if state is not None:
+        state.finish_discovery(site_key, article_urls.values())
+
+    stats = frontier.stats()
+    print(f"[DISCOVERY COMPLETE] Found {len(article_urls)} articles")
+    print(f"[FRONTIER] queued={stats['queued']} seen={stats['seen']} "
+          f"memory={stats['memory_bytes'] / 1024:.0f} KB")
+    return list(article_urls.values())[:max_articles]
+
+
 def discover_all_links(start_url: str, max_pages: int = 500, max_articles: int = 10):
     """
     BFS crawler to explore the entire domain, collecting every article link.
     Uses plain requests (no Playwright) for fast discovery.
     SMART FILTERING: Excludes category/archive pages, only gets real articles.
+    Blocking wrapper around discover_all_links_async.
     """
-    visited = set()
-    queue = [start_url]
-    article_urls = set()
+    return asyncio.run(discover_all_links_async(start_url, max_pages, max_articles))
+
+
+# ------------------------------
+# Feed Discovery (RSS / Atom)
+# ------------------------------
+
+FeedEntry = namedtuple("FeedEntry", ["url", "published"])
+
+FEED_LINK_TYPES = ("application/rss+xml", "application/atom+xml", "application/rdf+xml")
+FEED_CONTENT_TYPES = FEED_LINK_TYPES + ("application/xml", "text/xml")
+
+
+def _local_name(tag) -> str:
+    """'{http://www.w3.org/2005/Atom}entry' -> 'entry'"""
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def parse_feed_date(value: str):
+    """Parse RSS (RFC 822) or Atom (ISO 8601) dates. Returns None if unparseable."""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
 
-    domain = urlparse(start_url).netloc
+def _timestamp(dt) -> float:
+    """Sortable timestamp; naive datetimes are taken as UTC, None sorts last."""
+    if dt is None:
+        return float("-inf")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def parse_feed(xml):
+    """
+    Yield FeedEntry(url, published) for every item of an RSS 2.0, RSS 1.0 (RDF)
+    or Atom feed. Namespace-agnostic; raises ET.ParseError if it is not XML.
+    """
+    root = ET.fromstring(xml)
 
-    while queue and len(visited) < max_pages and len(article_urls) < max_articles:
-        url = queue.pop(0)
-        if url in visited:
+    for item in root.iter():
+        if _local_name(item.tag) not in ("item", "entry"):
             continue
 
-        visited.add(url)
-        print(f"[DISCOVERY] Visiting: {url}")
+        link = ""
+        orig_link = ""
+        guid = ""
+        published = None
+
+        for child in item:
+            name = _local_name(child.tag)
+            text = (child.text or "").strip()
+
+            if name == "link":
+                # Atom: <link rel="alternate" href="..."/>, RSS: <link>...</link>
+                href = child.attrib.get("href")
+                if href:
+                    if child.attrib.get("rel", "alternate") == "alternate" and not link:
+                        link = href.strip()
+                elif text and not link:
+                    link = text
+            elif name == "origLink":  # feedburner
+                orig_link = text
+            elif name == "guid" and child.attrib.get("isPermaLink", "true") == "true":
+                guid = text
+            elif name in ("pubDate", "published", "date", "issued"):
+                published = parse_feed_date(text) or published
+            elif name in ("updated", "modified") and published is None:
+                published = parse_feed_date(text)
+
+        url = orig_link or link or (guid if guid.startswith("http") else "")
+        if url:
+            yield FeedEntry(url, published)
+
+
+def find_feed_link(html: str, base_url: str):
+    """Find an advertised <link rel="alternate"> RSS/Atom feed in an HTML page."""
+    tree = HTMLParser(html)
+    for node in tree.css("link[rel='alternate']"):
+        if node.attributes.get("type", "").lower() in FEED_LINK_TYPES:
+            href = node.attributes.get("href")
+            if href:
+                return urljoin(base_url, href)
+    return None
 
-        try:
-            # Use plain requests - no Playwright needed for discovery
-            response = requests.get(url, timeout=10, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
-            
-            if response.status_code != 200:
-                continue
 
-            html = response.text
-            links = extract_article_links(html, url)
+def discover_from_feed(feed_url: str, max_articles: int = 10, canonicalizer=None):
+    """
+    Read a site's RSS/Atom feed and return up to max_articles FeedEntry items,
+    newest first. If feed_url serves HTML, the feed advertised in it is used.
+    Returns [] when there is no usable feed.
+    """
+    if canonicalizer is None:
+        canonicalizer = URLCanonicalizer.for_site(feed_url)
+    domain = urlparse(canonicalizer(feed_url)).netloc
+
+    print(f"[FEED] Reading: {feed_url}")
+    # An HTML page is searched for an advertised feed
+    POLITENESS.wait_sync(feed_url)
+    fetched = fetch_html(
+        feed_url, DISCOVERY_HEADERS, timeout=10,
+        content_types=FEED_CONTENT_TYPES + HTML_CONTENT_TYPES,
+    )
+    if fetched.status != 200:
+        print(f"[FEED] HTTP {fetched.status}")
+        return []
+
+    if fetched.content_type in HTML_CONTENT_TYPES:
+        advertised = find_feed_link(decode_html(fetched.body, fetched.encoding)[0], fetched.url)
+        if not advertised:
+            print("[FEED] No feed advertised on page")
+            return []
+        print(f"[FEED] Following advertised feed: {advertised}")
+        POLITENESS.wait_sync(advertised)
+        fetched = fetch_html(advertised, DISCOVERY_HEADERS, timeout=10, content_types=FEED_CONTENT_TYPES)
+        if fetched.status != 200:
+            print(f"[FEED] HTTP {fetched.status}")
+            return []
 
-            for link in links:
-                # Only stay on the same domain
-                if urlparse(link).netloc != domain:
-                    continue
+    try:
+        raw_entries = list(parse_feed(fetched.body))
+    except ET.ParseError as e:
+        print(f"[FEED] Not a valid feed: {e}")
+        return []
+
+    entries = {}  # canonical key -> FeedEntry with the URL as listed
+    for entry in raw_entries:
+        key = canonicalizer(entry.url)
+        if urlparse(key).netloc != domain:
+            continue
+        if URL_CLASSIFIER.classify(key)[0] == URLClassifier.EXCLUDE:
+            continue
+        if key not in entries:
+            entries[key] = FeedEntry(urldefrag(entry.url)[0], entry.published)
+
+    # Newest first; undated entries keep feed order after dated ones
+    ordered = sorted(entries.values(), key=lambda e: _timestamp(e.published), reverse=True)
+    print(f"[FEED] Found {len(ordered)} articles")
+    return ordered[:max_articles]
+
+
+# ------------------------------
+# Sitemap Discovery
+# ------------------------------
+
+_robots_cache = {}
 
-                # =====================================================
-                # SMART ARTICLE DETECTION - Two-stage filtering
-                # =====================================================
-                
-                # STAGE 1: HARD EXCLUSIONS - Never crawl these, never add to queue
-                # These are obvious non-article pages that waste resources
-                hard_exclude_patterns = [
-                    r"\?share=",            # Share links
-                    r"[&#]share=",          # Share parameters
-                    r"/\d+-\d+x\d+/",      # Image dimensions
-                    r"\d+x\d+\.(jpg|jpeg|png|gif|webp)",  # Thumbnail files
-                    r"#respond",            # Comment links
-                    r"#comment",
-                    r"/page/\d+",           # Pagination
-                    r"/author/",            # Author pages
-                    r"/writers?/",          # Writer pages
-                ]
-                
-                if any(re.search(pattern, link, re.I) for pattern in hard_exclude_patterns):
+
+def get_robots(site_url: str):
+    """Fetch and parse robots.txt for a site (cached per host). Returns None if unavailable."""
+    parts = urlsplit(site_url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    if key in _robots_cache:
+        return _robots_cache[key]
+
+    robots = None
+    try:
+        POLITENESS.wait_sync(site_url, crawl_delay=False)
+        fetched = fetch_html(
+            f"{key}/robots.txt", DISCOVERY_HEADERS, timeout=10,
+            max_bytes=ROBOTS_MAX_BYTES, content_types=("text/plain",),
+        )
+        if fetched.status == 200:
+            robots = RobotFileParser(f"{key}/robots.txt")
+            robots.parse(decode_html(fetched.body, fetched.encoding)[0].splitlines())
+    except Exception as e:
+        print(f"[ROBOTS] Error: {e}")
+
+    _robots_cache[key] = robots
+    return robots
+
+
+def _sitemap_entries(parser, root):
+    """
+    Drain finished <url>/<sitemap> elements from an XMLPullParser.
+    root is a list holding the document element once its start event is seen.
+    """
+    for event, elem in parser.read_events():
+        if event == "start":
+            if not root:
+                root.append(elem)
+            continue
+
+        kind = _local_name(elem.tag)
+        if kind not in ("url", "sitemap"):
+            continue
+
+        loc = ""
+        lastmod = None
+        for child in elem.iter():
+            name = _local_name(child.tag)
+            if name == "loc" and not loc:
+                loc = (child.text or "").strip()
+            elif name in ("lastmod", "publication_date"):  # news:publication_date
+                lastmod = parse_feed_date(child.text) or lastmod
+
+        # Detach finished entries from the root - clearing just the entry
+        # would still leave an empty element per <url> attached to it
+        root[0].clear()
+        if loc:
+            yield kind, loc, lastmod
+
+
+def iter_sitemap(chunks, max_bytes=SITEMAP_MAX_BYTES):
+    """
+    Stream-parse a sitemap or sitemap index from an iterable of byte chunks,
+    gunzipping on the fly when the body is gzip data (sitemap.xml.gz).
+    Yields (kind, loc, lastmod) with kind "sitemap" (index entry) or "url".
+    Entries are dropped from the tree as they are consumed, so memory stays flat.
+    Raises FetchRejected once the (unpacked) XML passes max_bytes.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = []
+    decompressor = None
+    started = False
+    size = 0
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if not started:
+            started = True
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is not None:
+            # Never unpack more than one byte past the cap
+            chunk = decompressor.decompress(chunk, max_bytes - size + 1)
+        size += len(chunk)
+        if size > max_bytes:
+            raise FetchRejected(f"too large (over {max_bytes:,} bytes unpacked)")
+        parser.feed(chunk)
+        yield from _sitemap_entries(parser, root)
+
+    parser.close()
+    yield from _sitemap_entries(parser, root)
+
+
+def discover_from_sitemaps(
+    site_url: str,
+    max_articles: int = 10,
+    canonicalizer=None,
+    max_age_days=SITEMAP_MAX_AGE_DAYS,
+):
+    """
+    Walk the site's sitemaps (listed in robots.txt, else /sitemap.xml) and
+    return up to max_articles FeedEntry items, newest first. Only entries with
+    a recent enough lastmod that pass the article URL heuristics are kept.
+    """
+    if canonicalizer is None:
+        canonicalizer = URLCanonicalizer.for_site(site_url)
+    domain = urlparse(canonicalizer(site_url)).netloc
+
+    robots = get_robots(site_url)
+    sitemaps = (robots.site_maps() if robots else None) or [urljoin(site_url, "/sitemap.xml")]
+
+    cutoff = None
+    if max_age_days is not None:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).timestamp()
+
+    pending = deque(sitemaps)
+    fetched = set()
+    newest = []  # min-heap of (timestamp, seq, FeedEntry), capped at max_articles
+    seen = set()
+
+    while pending and len(fetched) < SITEMAP_MAX_FILES:
+        sitemap_url = pending.popleft()
+        if sitemap_url in fetched:
+            continue
+        fetched.add(sitemap_url)
+        print(f"[SITEMAP] Reading: {sitemap_url}")
+
+        try:
+            POLITENESS.wait_sync(sitemap_url)
+            with get_http_session().get(
+                sitemap_url, timeout=10, headers=DISCOVERY_HEADERS, stream=True
+            ) as response:
+                if response.status_code != 200:
+                    print(f"[SITEMAP] HTTP {response.status_code}")
                     continue
-                
-                # STAGE 2: SOFT EXCLUSIONS - Can visit for discovery, but don't mark as articles
-                # These are section/category pages that might contain article links
-                soft_exclude_patterns = [
-                    r"/category/?$",
-                    r"/categories/?$",
-                    r"/tag/?$",
-                    r"/tags/?$",
-                    r"/topics?/?$",
-                    r"/archive/?$",
-                    r"/archives/?$",
-                    r"/\d{4}/?$",           # Just year: /2023/
-                    r"/\d{4}/\d{2}/?$",     # Just year/month: /2023/08/
-                    r"/hub/?$",
-                    r"/all-articles/?$",
-                    r"/news/?$",            # Section page, not article
-                    r"/world-news/?$",
-                    r"/politics/?$",
-                    r"/opinion/?$",
-                    r"/sports/?$",
-                    r"/tech/?$",
-                    r"/business/?$",
-                    r"/story/?$",           # Story section, not article
-                ]
-                
-                is_section_page = any(re.search(pattern, link, re.I) for pattern in soft_exclude_patterns)
-                
-                # Add to queue for further discovery (even if it's a section page)
-                if link not in visited:
-                    queue.append(link)
-                
-                # STAGE 3: ARTICLE DETECTION - Only mark as article if it passes these tests
-                if not is_section_page:
-                    is_article = False
-                    
-                    # Pattern 1: Has /article/ in URL (common for news sites)
-                    if "/article/" in link:
-                        is_article = True
-                        print(f"   ✓ Article pattern: /article/ in URL")
-                    
-                    # Pattern 2: News/Story with full date path
-                    # /news/2024/01/26/title-slug or /story/2024/01/26/title-slug
-                    elif re.search(r"/(news|story)/20\d{2}/\d{2}/\d{2}/[\w-]+", link):
-                        is_article = True
-                        print(f"   ✓ Article pattern: /news or /story with full date")
-                    
-                    # Pattern 3: Date-based URL with day (full article URL)
-                    # /2024/01/26/title-slug/ or /2024/01/26/title-slug
-                    elif re.search(r"/20\d{2}/\d{2}/\d{2}/[\w-]+", link):
-                        is_article = True
-                        print(f"   ✓ Article pattern: Full date path")
-                    
-                    # Pattern 4: WordPress-style: /year/month/slug (no day)
-                    elif re.search(r"/20\d{2}/\d{2}/[\w-]{10,}", link) and not link.endswith('/'):
-                        is_article = True
-                        print(f"   ✓ Article pattern: WordPress date style")
-                    
-                    # Pattern 5: Long unique slug at end (likely article, not category)
-                    # Must be at least 20 chars and not end with common category names
-                    elif re.search(r"/[\w-]{20,}/?$", link):
-                        slug = link.rstrip('/').split('/')[-1]
-                        category_words = [
-                            'news', 'politics', 'world', 'business', 'sports', 
-                            'tech', 'technology', 'science', 'opinion', 'entertainment', 
-                            'lifestyle', 'health', 'culture', 'economy', 'society'
-                        ]
-                        if slug.lower() not in category_words:
-                            is_article = True
-                            print(f"   ✓ Article pattern: Long slug ({len(slug)} chars)")
-                    
-                    # Add to article list if it passes filters
-                    if is_article and link not in article_urls:
-                        article_urls.add(link)
-                        print(f"   📰 ARTICLE ADDED: {link}")
-                        
-                        if len(article_urls) >= max_articles:
-                            print(f"[DISCOVERY] ✅ HARD STOP: reached {max_articles} article URLs")
-                            break
-
-            time.sleep(random.uniform(1.5, 4.0))
-  # Be nice to servers
 
+                chunks = response.iter_content(chunk_size=64 * 1024)
+                for kind, loc, lastmod in iter_sitemap(chunks):
+                    stamp = _timestamp(lastmod)
+                    if cutoff is not None and lastmod is not None and stamp < cutoff:
+                        continue
+
+                    if kind == "sitemap":
+                        pending.append(loc)
+                        continue
+
+                    key = canonicalizer(loc)
+                    if key in seen or urlparse(key).netloc != domain:
+                        continue
+                    if URL_CLASSIFIER.classify(key)[0] != URLClassifier.ARTICLE:
+                        continue
+                    seen.add(key)
+
+                    item = (stamp, len(seen), FeedEntry(urldefrag(loc)[0], lastmod))
+                    if len(newest) < max_articles:
+                        heapq.heappush(newest, item)
+                    elif item > newest[0]:
+                        heapq.heapreplace(newest, item)
+        except (ET.ParseError, OSError, requests.RequestException, FetchRejected) as e:
+            print(f"[SITEMAP] Error in {sitemap_url}: {e}")
+
+    entries = [entry for _, _, entry in sorted(newest, reverse=True)]
+    print(f"[SITEMAP] Found {len(entries)} articles in {len(fetched)} sitemap(s)")
+    return entries
+
+
+# ------------------------------
+# Politeness Scheduler
+# ------------------------------
+
+class HostScheduler:
+    """
+    Per-host politeness: request starts to one host are spaced at least a
+    random POLITENESS_DELAY apart (or the robots.txt Crawl-delay, if larger).
+    wait() only suspends the caller, so requests to other hosts proceed.
+    wait_sync() is the blocking twin for fetches made from worker threads
+    (feeds, sitemaps, robots.txt); both draw from the same per-host slots.
+    """
+
+    def __init__(self, delay=POLITENESS_DELAY, respect_crawl_delay=RESPECT_CRAWL_DELAY):
+        self.delay = delay
+        self.respect_crawl_delay = respect_crawl_delay
+        self._next_slot = {}     # host -> monotonic time of the next free slot
+        self._crawl_delays = {}  # host -> robots.txt Crawl-delay (0 if none)
+        self._lock = threading.Lock()
+
+    def _record_crawl_delay(self, host: str, robots) -> float:
+        delay = robots.crawl_delay(DISCOVERY_HEADERS["User-Agent"]) if robots else None
+        self._crawl_delays[host] = float(delay or 0)
+        if delay:
+            print(f"[POLITENESS] {host}: robots.txt Crawl-delay {delay}s")
+        return self._crawl_delays[host]
+
+    async def _crawl_delay(self, url: str, host: str) -> float:
+        if not self.respect_crawl_delay:
+            return 0.0
+        if host not in self._crawl_delays:
+            return self._record_crawl_delay(host, await asyncio.to_thread(get_robots, url))
+        return self._crawl_delays[host]
+
+    def _crawl_delay_sync(self, url: str, host: str) -> float:
+        if not self.respect_crawl_delay:
+            return 0.0
+        if host not in self._crawl_delays:
+            return self._record_crawl_delay(host, get_robots(url))
+        return self._crawl_delays[host]
+
+    def _reserve(self, host: str, delay: float) -> float:
+        """Reserve host's next slot; returns how long to wait for it."""
+        # Reserve the slot before sleeping, so concurrent callers queue up behind it
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + delay
+        return slot - now
+
+    async def wait(self, url: str):
+        """Wait until the next request to url's host may start."""
+        host = urlsplit(url).netloc
+        delay = max(random.uniform(*self.delay), await self._crawl_delay(url, host))
+        pause = self._reserve(host, delay)
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    def wait_sync(self, url: str, crawl_delay: bool = True):
+        """
+        Block until the next request to url's host may start.
+        crawl_delay=False skips the robots.txt lookup - used by the
+        robots.txt fetch itself.
+        """
+        host = urlsplit(url).netloc
+        delay = random.uniform(*self.delay)
+        if crawl_delay:
+            delay = max(delay, self._crawl_delay_sync(url, host))
+        pause = self._reserve(host, delay)
+        if pause > 0:
+            time.sleep(pause)
+
+
+POLITENESS = HostScheduler()
+
+
+# ------------------------------
+# Discovery
+# ------------------------------
+
+def _merge_entries(entries, new_entries, max_articles, canonicalizer):
+    """Append new_entries to entries (no two with the same canonical URL), up to max_articles."""
+    seen = {canonicalizer(e.url) for e in entries}
+    for entry in new_entries:
+        if len(entries) >= max_articles:
+            break
+        key = canonicalizer(entry.url)
+        if key not in seen:
+            entries.append(entry)
+            seen.add(key)
+    return entries
+
+
+async def discover_articles(
+    site_url: str,
+    rss_url: str = None,
+    max_pages: int = 500,
+    max_articles: int = 10,
+    canonicalizer=None,
+    mode: str = None,
+    state=None,
+    resume: bool = False,
+    boilerplate=None,
+):
+    """
+    Find article URLs for a site according to DISCOVERY_MODE (or mode):
+    feed first (one request), then sitemaps (a handful of requests),
+    and the BFS crawl only as a fallback.
+    Returns FeedEntry items; published is None for BFS results.
+    """
+    mode = mode or DISCOVERY_MODE
+    if canonicalizer is None:
+        canonicalizer = URLCanonicalizer.for_site(site_url)
+    enough = min(FEED_MIN_ARTICLES, max_articles)
+
+    entries = []
+    if mode in ("auto", "feed") and rss_url:
+        try:
+            feed = await asyncio.to_thread(discover_from_feed, rss_url, max_articles, canonicalizer)
+            _merge_entries(entries, feed, max_articles, canonicalizer)
         except Exception as e:
-            print(f"[DISCOVERY] Error: {e}")
+            print(f"[FEED] Error: {e}")
 
-    print(f"[DISCOVERY COMPLETE] Found {len(article_urls)} articles")
-    return list(article_urls)[:max_articles]
+    if mode == "sitemap" or (mode == "auto" and len(entries) < enough):
+        try:
+            sitemap = await asyncio.to_thread(
+                discover_from_sitemaps, site_url, max_articles, canonicalizer
+            )
+            _merge_entries(entries, sitemap, max_articles, canonicalizer)
+        except Exception as e:
+            print(f"[SITEMAP] Error: {e}")
+
+    if mode in ("feed", "sitemap") or len(entries) >= enough:
+        return entries
+
+    if mode == "auto":
+        print(f"[DISCOVERY] {len(entries)} feed/sitemap articles - falling back to BFS discovery")
+
+    urls = await discover_all_links_async(
+        site_url, max_pages=max_pages, max_articles=max_articles,
+        canonicalizer=canonicalizer, state=state, resume=resume, boilerplate=boilerplate,
+    )
+
+    # Keep feed/sitemap entries (they carry dates), then fill up with BFS results
+    return _merge_entries(entries, [FeedEntry(url, None) for url in urls], max_articles, canonicalizer)
 
 
 # ------------------------------
 # CRAWL SITE
 # ------------------------------
 
-async def crawl_site(db, blog, site_url):
+async def crawl_site(db, blog, site_url, canonical_rules=None, discovery_mode=None,
+                     state=None, resume=False, cleaning_mode=None):
     print(f"\n🌐 Crawling site: {site_url}")
 
-    # STEP 1 — FULL SITE DISCOVERY using BFS (plain requests, no Playwright)
+    # One canonical form for every URL of this site (discovery, fetch, DB key)
+    canonicalizer = URLCanonicalizer.for_site(site_url, canonical_rules)
+
+    # Repeated site chrome, learned from discovery pages and articles
+    boilerplate = BoilerplateModel()
+
+    # Cleaning method (see CLEANING_MODE); "auto" routes and counts per site
+    mode = cleaning_mode or CLEANING_MODE
+    clean = CleaningRouter(site_url) if mode == "auto" else CLEANERS[mode]
+
+    # STEP 1 — DISCOVERY: RSS/Atom feed first, full-site BFS as fallback
     print("🔍 Discovering all links...")
-    article_urls = discover_all_links(site_url, max_pages=500, max_articles=10)
+    entries = await discover_articles(
+        site_url, blog.rss_url, max_pages=500, max_articles=10,
+        canonicalizer=canonicalizer, mode=discovery_mode, state=state, resume=resume,
+        boilerplate=boilerplate,
+    )
+    article_urls = [e.url for e in entries]
+    feed_dates = {e.url: e.published for e in entries if e.published}
     
     print(f"📝 Identified {len(article_urls)} article URLs")
 
     inserted = 0
     skipped = 0
+    crawled = set()  # canonical URLs after redirects
 
     # STEP 2 — CRAWL EACH ARTICLE
     for u in article_urls:
@@ -828,7 +3112,8 @@ async def crawl_site(db, blog, site_url):
             break
             
         print(f"\n➡️ Crawling article: {u}")
-        res = crawl_article(u)
+        await POLITENESS.wait(u)
+        res = await asyncio.to_thread(crawl_article, u, canonicalizer, boilerplate)
 
         if not res:
             print(f"   ❌ SKIP: crawl_article returned None (request failed)")
@@ -840,8 +3125,15 @@ async def crawl_site(db, blog, site_url):
             skipped += 1
             continue
 
+        if res.url in crawled:
+            print(f"   ❌ SKIP: redirects to already crawled {res.url}")
+            skipped += 1
+            continue
+        crawled.add(res.url)
+
         html = res.html or ""
-        raw_text = res.markdown or strip_html_basic(html)
+        page = res.page
+        raw_text = res.markdown or page.text
 
         print(f"   [DEBUG] HTML length: {len(html)} chars")
         print(f"   [DEBUG] Raw text length: {len(raw_text)} chars")
@@ -852,15 +3144,13 @@ async def crawl_site(db, blog, site_url):
             skipped += 1
             continue
 
-        title, author, published = extract_metadata(html)
+        title, author, published = page.metadata(default_published=feed_dates.get(u))
         print(f"   [METADATA] Title: {title[:50]}...")
         print(f"   [METADATA] Author: {author}")
         
-        # Extract clean text (choose method based on flag)
-        if USE_LLM_CLEANING:
-            cleaned_text = gpt_clean(html)
-        else:
-            cleaned_text = manual_clean(html)
+        # Extract clean text (choose method based on CLEANING_MODE)
+        # Blocking LLM/parsing work runs in a thread so other sites keep going
+        cleaned_text = await asyncio.to_thread(clean, page)
         
         print(f"   [CLEAN] Cleaned text length: {len(cleaned_text)} chars")
         
@@ -869,14 +3159,16 @@ async def crawl_site(db, blog, site_url):
             skipped += 1
             continue
         
-        # Also clean the HTML field (remove doctype, head, scripts)
-        cleaned_html = extract_article_content(html)
+        # Also clean the HTML field (remove doctype, head, scripts) - cached on the page.
+        # Density mode stores the block its text came from, not the selector container
+        cleaned_html = page.content_html if mode == "density" else page.article_html
         
         # Generate summary
-        summary = gpt_summary(cleaned_text)
+        summary = await asyncio.to_thread(gpt_summary, cleaned_text)
 
-        post_id = upsert_post(
-            db, blog.id, u,
+        post_id = await asyncio.to_thread(
+            upsert_post,
+            db, blog.id, res.url,  # canonical URL is the post key
             title, cleaned_text, cleaned_html,  # both cleaned now
             author, [], published, summary
         )
@@ -888,12 +3180,79 @@ async def crawl_site(db, blog, site_url):
             print(f"   ⚠️ SKIP: Post already exists in database (url_canonical conflict)")
             skipped += 1
 
-        time.sleep(0.2)
+    # Site finished - nothing left to resume
+    if state is not None:
+        state.clear(canonicalizer(site_url))
+    TEMPLATES.save()
+    if isinstance(clean, CleaningRouter):
+        clean.report()
 
     print(f"\n📦 Done: Inserted={inserted}, Skipped={skipped}")
     return inserted, skipped
 
 
+# ------------------------------
+# CRAWL ALL SITES
+# ------------------------------
+
+def get_or_create_blog(db, site_url, rss):
+    stmt = select(Blog).where(
+        (Blog.url == site_url) | (Blog.rss_url == rss)
+    )
+    blog = db.execute(stmt).scalar()
+
+    if not blog:
+        blog = Blog(
+            name=urlparse(site_url).netloc,
+            url=site_url,
+            rss_url=rss,
+            language="en"
+        )
+        db.add(blog)
+        db.commit()
+        db.refresh(blog)
+
+    return blog
+
+
+async def crawl_one_site(site, **options):
+    """Crawl one sites-file entry with its own DB session. Returns the number of new posts."""
+    db = SessionLocal()
+    try:
+        site_url = site["site_url"]
+        blog = await asyncio.to_thread(get_or_create_blog, db, site_url, site.get("rss_url"))
+        new, skipped = await crawl_site(
+            db, blog, site_url, canonical_rules=site.get("canonical_rules"), **options
+        )
+        return new
+    finally:
+        db.close()
+
+
+async def crawl_all_sites(sites, max_concurrent_sites: int = MAX_CONCURRENT_SITES, **options):
+    """
+    Crawl all sites concurrently, at most max_concurrent_sites at a time.
+    A failing site is logged and counted as 0 new posts; the rest carry on.
+    Wall-clock time follows the slowest sites, not the sum of all of them.
+    """
+    # Discovery fetches, article fetches and LLM calls all run in worker threads
+    workers = max_concurrent_sites * (DISCOVERY_MAX_CONCURRENCY + 2)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+
+    slots = asyncio.Semaphore(max_concurrent_sites)
+
+    async def run(site):
+        async with slots:
+            try:
+                return await crawl_one_site(site, **options)
+            except Exception as e:
+                print(f"\n❌ Site failed: {site.get('site_url')}: {e}")
+                return 0
+
+    results = await asyncio.gather(*(run(site) for site in sites))
+    return sum(results)
+
+
 # ------------------------------
 # MAIN
 # ------------------------------
@@ -901,39 +3260,47 @@ async def crawl_site(db, blog, site_url):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--sites-file", default="app/feed/sites.json")
+    parser.add_argument("--discovery", choices=["auto", "feed", "sitemap", "bfs"], default=DISCOVERY_MODE,
+                        help="auto = RSS/Atom feed, then sitemaps, then BFS fallback")
+    parser.add_argument("--cleaning", choices=["auto", *CLEANERS], default=CLEANING_MODE,
+                        help="auto = manual, LLM only when the result looks poor, llm = LLM cleaning, "
+                             "manual = container selectors, density = text-density scoring")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue interrupted discoveries from the last checkpoint")
+    parser.add_argument("--state-file", default=CRAWL_STATE_PATH)
+    parser.add_argument("--max-sites", type=int, default=MAX_CONCURRENT_SITES,
+                        help="how many sites to crawl at the same time")
     args = parser.parse_args()
 
     with open(args.sites_file, "r") as fp:
         sites = json.load(fp)
 
-    db = SessionLocal()
+    state = CrawlStateStore(args.state_file)
 
-    total = 0
-    for site in sites:
-        site_url = site["site_url"]
-        rss = site.get("rss_url")
-
-        stmt = select(Blog).where(
-            (Blog.url == site_url) | (Blog.rss_url == rss)
+    total = asyncio.run(
+        crawl_all_sites(
+            sites,
+            max_concurrent_sites=args.max_sites,
+            discovery_mode=args.discovery,
+            cleaning_mode=args.cleaning,
+            state=state,
+            resume=args.resume,
         )
-        blog = db.execute(stmt).scalar()
-
-        if not blog:
-            blog = Blog(
-                name=urlparse(site_url).netloc,
-                url=site_url,
-                rss_url=rss,
-                language="en"
-            )
-            db.add(blog)
-            db.commit()
-            db.refresh(blog)
-
-        new, skipped = asyncio.run(crawl_site(db, blog, site_url))
-        total += new
+    )
 
     print(f"\n🚀 Finished. Total new posts: {total}")
 
+    stats = LLM.stats()
+    if stats["sent"]:
+        print(f"[LLM] {stats['sent']} requests ({stats['errors']} errors), "
+              f"peak {stats['peak_in_flight']}/{LLM.workers} in flight, "
+              f"avg queue wait {stats['avg_wait']:.2f}s")
+
+    cache = LLM_CACHE.stats()
+    if cache["hits"] or cache["misses"]:
+        print(f"[LLM CACHE] {cache['hits']} hits, {cache['misses']} misses, "
+              f"{cache['evicted']} evicted, {cache['bytes'] / 1e6:.1f} MB")
+
 
 if __name__ == "__main__":
     main()